@@ -1,6 +1,7 @@
 import json
 import warnings
-from typing import List
+from time import time
+from typing import Dict, List
 
 from bunq import Pagination
 from bunq.sdk.context.api_context import ApiContext
@@ -10,8 +11,15 @@ from bunq.sdk.model.generated import endpoint
 from bunq.sdk.model.generated.endpoint import Payment
 
 from bunq_ynab_connector._bunq.bunq_account import BunqAccount
+from bunq_ynab_connector._bunq.payment_store import PaymentStore
 from helpers.cache import cache
-from helpers.helpers import log, get_config, get_ynab_connector, retry
+from helpers.rate_limiter import RateLimiter
+from helpers.helpers import (
+    log,
+    get_config,
+    get_ynab_connector,
+    normalize_iban,
+)
 from _setup.load_config import BUNQ_CONFIG_FILE
 
 warnings.filterwarnings("ignore")
@@ -20,17 +28,36 @@ warnings.filterwarnings("ignore")
 class Bunq:
     """
     Class responsible for any _bunq connection functionality
+
+    ATTRIBUTES
+    ----------
+    payment_store: PaymentStore
+        Local store of all payments, such that we only fetch new payments from the api
+    RATE_LIMITER: RateLimiter
+        Bunq allows 3 GET requests per 3 seconds
     """
 
+    payment_store: PaymentStore
+    RATE_LIMITER = RateLimiter(3, 3)
+    # Don't sync an account again if it was synced less than this nr of seconds ago
+    PAYMENT_SYNC_INTERVAL = 60
+    # Monetary account id -> timestamp of last payment sync
+    _payments_synced_at: Dict[int, float]
+
+    # Index of normalized iban -> account, and the account list it was built from
+    _account_index: Dict[str, BunqAccount] = None
+    _account_index_source: List[BunqAccount] = None
+
     def __init__(self):
+        self.payment_store = PaymentStore()
+        self._payments_synced_at = {}
         self._load()
         self._check_callback()
 
-    @retry(2, message="Transaction not added")
     def add_transaction(self, transaction: dict):
         """
-        Add a transaction to _ynab. Should be called by Flask, whenever _bunq calls
-        webhook.
+        Add a transaction to _ynab. Should be called for each webhook that _bunq
+        calls. Raises on failure, retrying is done by the WebhookQueue
         """
         log(f"Adding transaction {transaction}")
         data = transaction["NotificationUrl"]["object"]["Payment"]
@@ -43,17 +70,66 @@ class Bunq:
         payee = data["counterparty_alias"]["display_name"]
         get_ynab_connector().add_transaction(iban, payee, amount, memo, data)
         log("Transaction added!")
+        # Don't raise, otherwise the transaction would be added to ynab again
+        try:
+            self.payment_store.add_raw_payment(data)
+        except Exception as e:
+            log(f"Could not save payment in payment store: {e}", True)
 
     @cache(ttl=60 * 60 * 24)
     def get_bunq_accounts(self) -> List[BunqAccount]:
         """
         Get a list of all bunq accounts
         """
+        self.RATE_LIMITER.acquire()
         return [BunqAccount(a) for a in endpoint.MonetaryAccount.list().value]
 
+    def get_bunq_account_index(self) -> Dict[str, BunqAccount]:
+        """
+        Get a dict of normalized iban -> account. The index is rebuilt whenever
+        get_bunq_accounts() returns a refreshed list, hence both are always in sync.
+        Accounts without iban are skipped
+        """
+        accounts = self.get_bunq_accounts()
+        if self._account_index_source is not accounts:
+            index = {}
+            for account in accounts:
+                try:
+                    index.setdefault(normalize_iban(account.iban), account)
+                except ValueError:
+                    continue
+            self._account_index = index
+            self._account_index_source = accounts
+        return self._account_index
+
     def get_transactions(self, account_id: int) -> List[Payment]:
         """
-        Get the payments of a BunqAccount
+        Get the payments of a BunqAccount. First sync the payment store, then load all
+        payments from the store
+        """
+        self.sync_transactions(account_id)
+        return self.payment_store.get_payments(account_id)
+
+    def sync_transactions(self, account_id: int) -> None:
+        """
+        Sync the payments of a BunqAccount into the payment store. Only fetch the
+        payments that are newer than the previous sync
+        """
+        synced_at = self._payments_synced_at.get(account_id)
+        interval = self.PAYMENT_SYNC_INTERVAL
+        if synced_at is not None and time() - synced_at < interval:
+            return
+        newest_id = self.payment_store.get_newest_synced_id(account_id)
+        if newest_id is None:
+            payments = self._get_all_payments(account_id)
+        else:
+            payments = self._get_payments_newer_than(account_id, newest_id)
+        self.payment_store.add_synced_payments(account_id, payments)
+        self._payments_synced_at[account_id] = time()
+
+    def _get_all_payments(self, account_id: int) -> List[Payment]:
+        """
+        Get the complete payment history of an account
         """
         # Max allowed count is 200
         payments = []
@@ -65,6 +141,7 @@ class Bunq:
         should_continue = True
 
         while should_continue:
+            self.RATE_LIMITER.acquire()
             query_result = endpoint.Payment.list(
                 monetary_account_id=account_id, params=params
             )
@@ -75,6 +152,31 @@ class Bunq:
                 params = query_result.pagination.url_params_previous_page
         return payments
 
+    def _get_payments_newer_than(
+        self, account_id: int, payment_id: int
+    ) -> List[Payment]:
+        """
+        Get the payments of an account that are newer than payment_id
+        """
+        # Max allowed count is 200
+        payments = []
+        pagination = Pagination()
+        pagination.count = 200
+        pagination.newer_id = payment_id
+        params = pagination.url_params_next_page
+        should_continue = True
+
+        while should_continue:
+            self.RATE_LIMITER.acquire()
+            query_result = endpoint.Payment.list(
+                monetary_account_id=account_id, params=params
+            )
+            payments.extend(query_result.value)
+            should_continue = query_result.pagination.has_next_page_assured()
+            if should_continue:
+                params = query_result.pagination.url_params_next_page
+        return payments
+
     def get_payment(self, payment_id: int, monetary_account_id: int) -> Payment:
         """
         Get a single payment, by the payment id
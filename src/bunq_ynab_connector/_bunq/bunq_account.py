@@ -27,10 +27,15 @@ class BunqAccount:
     @staticmethod
     def update_transaction(t: Payment):
         """
-        Update a bunq transaction: add date
+        Update a bunq transaction: add date and datetime
         """
-        t.date = parser.parse(t.created).date()
-        t.datetime = parser.parse(t.created)
+        try:
+            # Bunq uses 'YYYY-MM-DD HH:MM:SS.ffffff', which is much faster to parse as
+            # iso format
+            t.datetime = datetime.fromisoformat(t.created)
+        except ValueError:
+            t.datetime = parser.parse(t.created)
+        t.date = t.datetime.date()
         return t
 
     @property
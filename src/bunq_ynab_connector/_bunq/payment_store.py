@@ -0,0 +1,95 @@
+import json
+import sqlite3
+from contextlib import closing
+from typing import Dict, List, Optional
+
+from bunq.sdk.model.generated.endpoint import Payment
+
+from helpers.cache import CACHE_DIR
+
+PAYMENT_STORE_FILE = f"{CACHE_DIR}/payments.sqlite"
+
+
+class PaymentStore:
+    """
+    Local append-only store of bunq payments, per monetary account. Payments are saved
+    as json, hence they can be loaded as Payment again.
+
+    Next to the payments, it remembers the newest payment id that was synced through
+    the api for each account. Payments received through the webhook are saved as well,
+    but do not move this marker, such that we never skip payments on the next sync.
+    """
+
+    path: str
+
+    def __init__(self, path: str = PAYMENT_STORE_FILE):
+        self.path = path
+        with closing(self._connect()) as connection, connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS payments ("
+                "monetary_account_id INTEGER, id INTEGER, data TEXT, "
+                "PRIMARY KEY (monetary_account_id, id))"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS sync_state ("
+                "monetary_account_id INTEGER PRIMARY KEY, newest_synced_id INTEGER)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        # One connection per call, the store is used from multiple threads
+        return sqlite3.connect(self.path, timeout=30)
+
+    def get_newest_synced_id(self, monetary_account_id: int) -> Optional[int]:
+        """
+        Get the id of the newest payment synced through the api, None if the account
+        was never synced
+        """
+        with closing(self._connect()) as connection:
+            row = connection.execute(
+                "SELECT newest_synced_id FROM sync_state WHERE monetary_account_id = ?",
+                (monetary_account_id,),
+            ).fetchone()
+        return row[0] if row is not None else None
+
+    def add_synced_payments(
+        self, monetary_account_id: int, payments: List[Payment]
+    ) -> None:
+        """
+        Save payments fetched through the api, and move the sync marker to the newest
+        """
+        rows = [(monetary_account_id, p.id_, p.to_json()) for p in payments]
+        with closing(self._connect()) as connection, connection:
+            connection.executemany(
+                "INSERT OR IGNORE INTO payments VALUES (?, ?, ?)", rows
+            )
+            if not rows:
+                return
+            connection.execute(
+                "INSERT INTO sync_state VALUES (?, ?) "
+                "ON CONFLICT (monetary_account_id) DO UPDATE SET "
+                "newest_synced_id = MAX(newest_synced_id, excluded.newest_synced_id)",
+                (monetary_account_id, max(row[1] for row in rows)),
+            )
+
+    def add_raw_payment(self, data: Dict) -> None:
+        """
+        Save a payment received through the webhook, as raw dict
+        """
+        with closing(self._connect()) as connection, connection:
+            connection.execute(
+                "INSERT OR IGNORE INTO payments VALUES (?, ?, ?)",
+                (data["monetary_account_id"], data["id"], json.dumps(data)),
+            )
+
+    def get_payments(self, monetary_account_id: int) -> List[Payment]:
+        """
+        Load all stored payments of an account, new to old
+        """
+        with closing(self._connect()) as connection:
+            rows = connection.execute(
+                "SELECT data FROM payments WHERE monetary_account_id = ? "
+                "ORDER BY id DESC",
+                (monetary_account_id,),
+            ).fetchall()
+        return [Payment.from_json(data) for data, in rows]
@@ -0,0 +1,36 @@
+from typing import Dict, List, Optional
+
+from ynab import Category
+
+
+class CategoryIndex:
+    """
+    Hash index over the categories of a budget
+
+    ATTRIBUTES
+    ----------
+    categories: List[Category]
+        The category list the index was built from
+    by_name: Dict[str, Category]
+        Category name -> category. If names are duplicated, the first one is used
+    by_id: Dict[str, Category]
+        Category id -> category
+    fallback: Optional[Category]
+        The category to use if no category could be predicted
+    """
+
+    FALLBACK_CATEGORY_NAME = "Inflow: Ready to Assign"
+
+    categories: List[Category]
+    by_name: Dict[str, Category]
+    by_id: Dict[str, Category]
+    fallback: Optional[Category]
+
+    def __init__(self, categories: List[Category]):
+        self.categories = categories
+        self.by_name = {}
+        self.by_id = {}
+        for category in categories or []:
+            self.by_name.setdefault(category.name, category)
+            self.by_id[category.id] = category
+        self.fallback = self.by_name.get(self.FALLBACK_CATEGORY_NAME)
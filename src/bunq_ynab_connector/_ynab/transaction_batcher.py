@@ -0,0 +1,119 @@
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from ynab import SaveTransaction
+
+from helpers.helpers import get_config, log
+
+
+class TransactionBatcher:
+    """
+    Micro-batching writer for ynab transactions. Transactions are coalesced per
+    budget, and submitted with a single bulk request when the batch window of the
+    budget expires, or when the batch is full. Each transaction gets a Future, that
+    is resolved with the result of that transaction in the bulk request. Also used
+    to coalesce the category predictions of raw payments, by passing a key function
+
+    ATTRIBUTES
+    ----------
+    submit_batch: Callable[[str, List[SaveTransaction]], Dict[str, str]]
+        Submits the transactions of a budget in one request. Returns the result
+        ('created' or 'duplicate') per import_id
+    key: Callable[[Any], str]
+        The key of an item in the results of submit_batch. The import_id by default
+    description: str
+        What the items are, for logging
+    window: float
+        Seconds to wait for more transactions after the first one of a batch
+    max_batch_size: int
+        Max nr of transactions per request
+    """
+
+    # Defaults, can be overridden in the config
+    BATCH_WINDOW_MS = 200
+    MAX_BATCH_SIZE = 50
+
+    submit_batch: Callable[[str, List[SaveTransaction]], Dict[str, str]]
+    key: Callable[[Any], str]
+    description: str
+    window: float
+    max_batch_size: int
+
+    def __init__(
+        self,
+        submit_batch: Callable[[str, List[SaveTransaction]], Dict[str, str]],
+        key: Optional[Callable[[Any], str]] = None,
+        description: str = "transactions",
+    ):
+        self.submit_batch = submit_batch
+        self.key = key or (lambda transaction: transaction.import_id)
+        self.description = description
+        self.window = get_config("ynab_batch_window_ms", self.BATCH_WINDOW_MS) / 1000
+        self.max_batch_size = get_config("ynab_max_batch_size", self.MAX_BATCH_SIZE)
+        self._lock = threading.Lock()
+        # Budget id -> pending transactions, with the future of each of them
+        self._pending: Dict[str, List[Tuple[SaveTransaction, Future]]] = {}
+
+    def add(self, budget_id: str, transaction: SaveTransaction) -> Future:
+        """
+        Add a transaction to the batch of its budget. The transaction must have a
+        key. Returns a Future, that resolves to the result of the transaction,
+        or raises if the request failed
+        """
+        future = Future()
+        with self._lock:
+            batch = self._pending.setdefault(budget_id, [])
+            batch.append((transaction, future))
+            if len(batch) >= self.max_batch_size:
+                batch = self._pending.pop(budget_id)
+            elif len(batch) == 1:
+                # First of a batch, flush it when the window expires
+                timer = threading.Timer(self.window, self._flush, [budget_id, batch])
+                timer.daemon = True
+                timer.start()
+                batch = None
+            else:
+                batch = None
+        if batch is not None:
+            self._submit(budget_id, batch)
+        return future
+
+    def _flush(
+        self, budget_id: str, batch: List[Tuple[SaveTransaction, Future]]
+    ) -> None:
+        """
+        Submit a batch of a budget when its window expires. Does nothing if the batch
+        was submitted already because it became full, the pending batch of the
+        budget is then a newer one, with its own window
+        """
+        with self._lock:
+            if self._pending.get(budget_id) is not batch:
+                return
+            del self._pending[budget_id]
+        self._submit(budget_id, batch)
+
+    def _submit(
+        self, budget_id: str, batch: List[Tuple[SaveTransaction, Future]]
+    ) -> None:
+        """
+        Submit a batch, and map the result of each transaction back to its future. If
+        the request fails, all futures raise
+        """
+        transactions = [transaction for transaction, _ in batch]
+        try:
+            results = self.submit_batch(budget_id, transactions)
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            log(f"Could not submit {len(batch)} {self.description}: {e}", True)
+            return
+        for transaction, future in batch:
+            result = results.get(self.key(transaction))
+            if result is None:
+                future.set_exception(
+                    Exception(f"No result for {self.key(transaction)}")
+                )
+            else:
+                future.set_result(result)
+        log(f"Submitted batch of {len(batch)} {self.description} of budget {budget_id}")
@@ -0,0 +1,91 @@
+import pickle
+import sqlite3
+from contextlib import closing
+from typing import List, Optional
+
+from ynab import TransactionDetail
+
+from helpers.cache import CACHE_DIR
+
+TRANSACTION_STORE_FILE = f"{CACHE_DIR}/ynab_transactions.sqlite"
+
+
+class TransactionStore:
+    """
+    Local store of ynab transactions, per budget. Next to the transactions, it saves
+    the server_knowledge of the last sync of each budget, such that we only have to
+    request the changes since then. Changed transactions overwrite the stored ones,
+    deleted transactions are removed.
+    """
+
+    path: str
+
+    def __init__(self, path: str = TRANSACTION_STORE_FILE):
+        self.path = path
+        with closing(self._connect()) as connection, connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS transactions ("
+                "budget_id TEXT, id TEXT, account_id TEXT, data BLOB, "
+                "PRIMARY KEY (budget_id, id))"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS sync_state ("
+                "budget_id TEXT PRIMARY KEY, server_knowledge INTEGER)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        # One connection per call, the store is used from multiple threads
+        return sqlite3.connect(self.path, timeout=30)
+
+    def get_server_knowledge(self, budget_id: str) -> Optional[int]:
+        """
+        Get the server_knowledge of the last sync, None if the budget was never synced
+        """
+        with closing(self._connect()) as connection:
+            row = connection.execute(
+                "SELECT server_knowledge FROM sync_state WHERE budget_id = ?",
+                (budget_id,),
+            ).fetchone()
+        return row[0] if row is not None else None
+
+    def merge(
+        self,
+        budget_id: str,
+        transactions: List[TransactionDetail],
+        server_knowledge: Optional[int],
+    ) -> None:
+        """
+        Merge a (delta) response into the store, in a single database transaction
+        """
+        deleted = [(budget_id, t.id) for t in transactions if t.deleted]
+        updated = [
+            (budget_id, t.id, t.account_id, pickle.dumps(t))
+            for t in transactions
+            if not t.deleted
+        ]
+        with closing(self._connect()) as connection, connection:
+            connection.executemany(
+                "DELETE FROM transactions WHERE budget_id = ? AND id = ?", deleted
+            )
+            connection.executemany(
+                "INSERT OR REPLACE INTO transactions VALUES (?, ?, ?, ?)", updated
+            )
+            if server_knowledge is not None:
+                connection.execute(
+                    "INSERT OR REPLACE INTO sync_state VALUES (?, ?)",
+                    (budget_id, server_knowledge),
+                )
+
+    def get_transactions(
+        self, budget_id: str, account_id: str
+    ) -> List[TransactionDetail]:
+        """
+        Load all stored transactions of an account
+        """
+        with closing(self._connect()) as connection:
+            rows = connection.execute(
+                "SELECT data FROM transactions WHERE budget_id = ? AND account_id = ?",
+                (budget_id, account_id),
+            ).fetchall()
+        return [pickle.loads(data) for data, in rows]
@@ -1,15 +1,18 @@
 from datetime import datetime
-from typing import Dict
-
-import requests
+from time import time
+from typing import Dict, Optional
 
 import ynab
 from ynab import Account, Category, TransactionDetail, SubTransaction
 from ynab.rest import ApiException
 
+from bunq_ynab_connector._ynab.category_index import CategoryIndex
+from bunq_ynab_connector._ynab.transaction_batcher import TransactionBatcher
+from bunq_ynab_connector._ynab.transaction_store import TransactionStore
 from bunq_ynab_connector._ynab.ynab_account import YnabAccount
-from helpers.cache import cache
+from helpers.cache import cache, CACHE_DIR
 from helpers.exceptions import YnabAccountNotFoundException
+from helpers.rate_limiter import SharedRateLimiter
 from helpers.helpers import *
 from bunq_ynab_connector._ynab.budget import Budget
 
@@ -23,6 +26,44 @@ class Ynab:
         3. Decide category based on payee name / iban
     """
     client = None
+    # Ynab allows 200 requests per hour per token. Shared by all processes
+    RATE_LIMITER = SharedRateLimiter(
+        200, 60 * 60, f"{CACHE_DIR}/ynab_rate_limit.sqlite"
+    )
+    # Calls on the webhook path fail instead of waiting longer than this nr of
+    # seconds for the rate limit, the webhook queue retries them later
+    WEBHOOK_MAX_WAIT = 5
+    # Max seconds get_budgets, get_ynab_accounts and get_categories wait for the
+    # rate limit. None (wait as long as needed, eg when training) unless set to
+    # WEBHOOK_MAX_WAIT by the transactions server
+    max_wait: Optional[float] = None
+    transaction_store: TransactionStore
+    # Don't sync a budget again if it was synced less than this nr of seconds ago
+    TRANSACTION_SYNC_INTERVAL = 60
+    # Budget id -> timestamp of last transaction sync
+    _transactions_synced_at: Dict[str, float]
+    # Index of normalized iban -> account, and the account list it was built from
+    _account_index: Dict[str, YnabAccount] = None
+    _account_index_source: List[YnabAccount] = None
+    # Category index per budget id
+    _category_indexes: Dict[str, CategoryIndex]
+    # Coalesces added transactions into bulk requests per budget
+    transaction_batcher: TransactionBatcher
+    # Coalesces the category predictions of added transactions per budget
+    prediction_batcher: TransactionBatcher
+    # Seconds to wait for a batch. If exceeded, adding the transaction fails and the
+    # webhook queue retries it. If the batch is created after all, the retry is
+    # ignored by ynab as duplicate import_id
+    BATCH_TIMEOUT = 60
+    IMPORT_ID_PREFIX = 'bunq:'
+    # 'http' to predict through the ModelServer, 'in_process' to load the models in
+    # this process. Can be overridden in the config
+    INFERENCE_MODE = 'http'
+    inference_mode: str
+    # If in process inference fails, predict through the ModelServer
+    inference_http_fallback: bool
+    # The models for in process inference
+    _model_cache = None
 
     def __init__(self):
         """
@@ -30,11 +71,25 @@ class Ynab:
         """
         self._monkey_patch_ynab()
         self.client = self._get_client()
+        self._category_indexes = {}
+        self.transaction_store = TransactionStore()
+        self._transactions_synced_at = {}
+        self.transaction_batcher = TransactionBatcher(self._create_transactions)
+        self.prediction_batcher = TransactionBatcher(
+            self._decide_categories_by_import_id, self._import_id, "predictions"
+        )
+        self.inference_mode = get_config('inference_mode', self.INFERENCE_MODE)
+        self.inference_http_fallback = get_config('inference_http_fallback', True)
 
     def add_transaction(self, iban: str, payee: str, value: float, memo: str,
                         raw_data: Dict) -> bool:
         """
-        Add a transaction. Called by the _bunq connector.
+        Add a transaction. Called by the _bunq connector. Its category is predicted
+        in a batch with the other transactions of its budget, see decide_categories.
+        The transaction is added to the batch of its budget, and this call blocks
+        until the batch is submitted.
+        The bunq payment id is used as import_id, hence ynab ignores a transaction
+        that was added before
         :param iban: The iban on which the transaction was made. Will be translated to
         account_id. If this translation fails,
         throw exception
@@ -46,7 +101,9 @@ class Ynab:
         """
         account = self.iban_to_account(iban)
         budget_id = account.budget_id
-        category = self._decide_category(budget_id, raw_data)
+        category = self.prediction_batcher.add(budget_id, raw_data).result(
+            self.BATCH_TIMEOUT
+        )
         date = datetime.datetime.now()
         value = int(value * 1000)  # Convert to the right units
         flag_color = 'blue'
@@ -57,12 +114,41 @@ class Ynab:
                                            payee_name=payee,
                                            category_id=category.id,
                                            memo=memo,
-                                           amount=value)
-        api = ynab.TransactionsApi(self.client)
-        response = api.create_transaction(budget_id,
-                                          ynab.SaveTransactionWrapper(transaction))
+                                           amount=value,
+                                           import_id=self._import_id(raw_data))
+        result = self.transaction_batcher.add(budget_id, transaction).result(
+            self.BATCH_TIMEOUT
+        )
+        if result == 'duplicate':
+            log(f"Transaction {transaction.import_id} was already added to ynab")
         return True
 
+    def _create_transactions(
+        self, budget_id: str, transactions: List[ynab.SaveTransaction]
+    ) -> Dict[str, str]:
+        """
+        Create transactions in a budget, with a single bulk request. Called by the
+        transaction batcher
+        :return: The result per import_id: 'duplicate' if a transaction with that
+        import_id already existed, else 'created'
+        """
+        api = ynab.TransactionsApi(self.client)
+        self.RATE_LIMITER.acquire(self.WEBHOOK_MAX_WAIT)
+        response = api.bulk_create_transactions(
+            budget_id, ynab.BulkTransactions(transactions))
+        duplicates = set(response.data.bulk.duplicate_import_ids or [])
+        return {
+            t.import_id: 'duplicate' if t.import_id in duplicates else 'created'
+            for t in transactions
+        }
+
+    @classmethod
+    def _import_id(cls, raw_data: Dict) -> str:
+        """
+        The import_id of a bunq payment, ynab allows at most 36 characters
+        """
+        return f"{cls.IMPORT_ID_PREFIX}{raw_data['id']}"
+
     def iban_to_account(self, iban: str) -> YnabAccount:
         """
         Convert an iban to an account id, by reading the 'Notes' on every account. The
@@ -71,11 +157,27 @@ class Ynab:
         :param iban:
         :return: The account id
         """
+        account = self.get_ynab_account_index().get(normalize_iban(iban))
+        if account is None:
+            raise YnabAccountNotFoundException(f"No account found for iban {iban}")
+        return account
+
+    def get_ynab_account_index(self) -> Dict[str, YnabAccount]:
+        """
+        Get a dict of normalized iban -> account. The index is rebuilt whenever
+        get_ynab_accounts() returns a refreshed list, hence both are always in sync. If
+        multiple accounts have the same iban, the first one is used
+        """
         accounts = self.get_ynab_accounts()
-        for account in accounts:
-            if account.iban == iban:
-                return account
-        raise YnabAccountNotFoundException(f"No account found for iban {iban}")
+        if self._account_index_source is not accounts:
+            index = {}
+            for account in accounts:
+                iban = normalize_iban(account.iban)
+                if iban and iban not in index:
+                    index[iban] = account
+            self._account_index = index
+            self._account_index_source = accounts
+        return self._account_index
 
     @cache(ttl=86400)
     def get_budgets(self) -> List[Budget]:
@@ -84,6 +186,7 @@ class Ynab:
         :return: The budgets
         """
         api = ynab.BudgetsApi(self.client)
+        self.RATE_LIMITER.acquire(self.max_wait)
         try:
             budgets = api.get_budgets()
             return [Budget(budget_info) for budget_info in budgets.data.budgets]
@@ -100,6 +203,7 @@ class Ynab:
         api = ynab.AccountsApi(self.client)
         accounts = []
         for b in self.get_budgets():
+            self.RATE_LIMITER.acquire(self.max_wait)
             try:
                 for account in api.get_accounts(b.id).data.accounts:
                     accounts.append(YnabAccount(account).set_budget_id(b.id))
@@ -118,6 +222,8 @@ class Ynab:
         """
         api = ynab.CategoriesApi(self.client)
         result = []
+        # Outside the try, an exceeded rate limit must not be cached as no categories
+        self.RATE_LIMITER.acquire(self.max_wait)
         try:
             for group in api.get_categories(budget_id).data.category_groups:
                 for category in group.categories:
@@ -126,41 +232,120 @@ class Ynab:
         except Exception as e:
             print(f"Exception when getting categories: {e}")
 
+    def get_category_index(self, budget_id: str) -> CategoryIndex:
+        """
+        Get the CategoryIndex of a budget. The index is rebuilt whenever
+        get_categories() returns a refreshed list, hence both are always in sync
+        """
+        categories = self.get_categories(budget_id)
+        index = self._category_indexes.get(budget_id)
+        if index is None or index.categories is not categories:
+            index = CategoryIndex(categories)
+            self._category_indexes[budget_id] = index
+        return index
+
     def get_transactions(self, account: YnabAccount) -> List[TransactionDetail]:
         """
-        Get an array of all the transactions of an account
+        Get an array of all the transactions of an account. Sync the budget of the
+        account first, then load the transactions from the transaction store
+        """
+        self.sync_transactions(account.budget_id)
+        return self.transaction_store.get_transactions(account.budget_id, account.id)
+
+    def sync_transactions(self, budget_id: str) -> None:
+        """
+        Sync the transactions of all accounts in a budget into the transaction store,
+        with a single call. If the budget was synced before, only request the changes
+        since the server_knowledge of that sync
         """
+        synced_at = self._transactions_synced_at.get(budget_id)
+        interval = self.TRANSACTION_SYNC_INTERVAL
+        if synced_at is not None and time() - synced_at < interval:
+            return
         api = ynab.TransactionsApi(self.client)
-        return api.get_transactions_by_account(account.budget_id,
-                                               account.id).data.transactions
-
-    def _decide_category(self, budget_id, raw_data: Dict) -> Category:
-        """
-        Decide the category of a payment:
-        - Load the url of the server that should host a model that can predict
-        transactions for this budget
-        - Post to the server
-        - If fail, use backup, else prediction
-        - Convert category string to category
-        :param budget_id: The id of the budget we are creating a transcation for
-        :param raw_data: The raw transaction data
-        :return: the category
-        """
-        # todo: Make sure the classifier can never predict invalid labels
+        server_knowledge = self.transaction_store.get_server_knowledge(budget_id)
+        self.RATE_LIMITER.acquire()
+        if server_knowledge is None:
+            data = api.get_transactions(budget_id).data
+        else:
+            data = api.get_transactions(
+                budget_id, last_knowledge_of_server=server_knowledge
+            ).data
+        self.transaction_store.merge(
+            budget_id, data.transactions, getattr(data, "server_knowledge", None)
+        )
+        self._transactions_synced_at[budget_id] = time()
+
+    def decide_categories(self, budget_id, raw_data: List[Dict]) -> List[Category]:
+        """
+        Decide the categories of a list of payments, with a single prediction call.
+        Used for bulk categorization, eg when backfilling, and to categorize the
+        batches of the prediction_batcher. Any payment for which no
+        valid category is predicted gets the fallback category
+        :param budget_id: The id of the budget the payments belong to
+        :param raw_data: The raw transaction data of each payment
+        :return: the categories, in order of raw_data
+        """
         invalid_categories = ['Split (Multiple Categories)...']
+        index = self.get_category_index(budget_id)
         try:
-            url = get_prediction_url(budget_id)
-            category_name = requests.post(url, json = raw_data).text
-            log(f"Category {category_name} was predicted")
-            if category_name in invalid_categories:
-                raise Exception(f"Category {category_name} is invalid, falling back to InFlow..")
+            predictions = self._predict_batch(budget_id, raw_data)
+            category_names = [p['category'] for p in predictions]
         except Exception as e:
-            log(f"Category could not be predicted: {e}")
-            category_name = 'Inflow: Ready to Assign'
-        for category in self.get_categories(budget_id):
-            if category.name == category_name:
-                return category
-        raise Exception(f'No category found for budget {budget_id} and category {category_name}')
+            log(f"Categories could not be predicted: {e}")
+            category_names = [index.FALLBACK_CATEGORY_NAME] * len(raw_data)
+        categories = []
+        for category_name in category_names:
+            category = None
+            if category_name not in invalid_categories:
+                category = index.by_name.get(category_name)
+            categories.append(category or index.fallback)
+        return categories
+
+    def _decide_categories_by_import_id(
+        self, budget_id: str, raw_data: List[Dict]
+    ) -> Dict[str, Category]:
+        """
+        Decide the categories of a batch of the prediction_batcher
+        :return: The category per import_id
+        """
+        categories = self.decide_categories(budget_id, raw_data)
+        return {self._import_id(d): c for d, c in zip(raw_data, categories)}
+
+    def _predict_batch(self, budget_id, raw_data: List[Dict]) -> List[Dict]:
+        """
+        Predict the categories of a list of payments. In process if configured, else
+        (or if that fails and the http fallback is enabled) by posting to the batch
+        endpoint of the ModelServer. Returns a list of dicts with 'category' and
+        'confidence'
+        """
+        if self.inference_mode == 'in_process':
+            try:
+                model = self._get_model_cache().get_model(budget_id)
+                return model.predict_batch(raw_data)
+            except Exception as e:
+                if not self.inference_http_fallback:
+                    raise e
+                log(f"In process prediction failed, falling back to http: {e}")
+        url = get_batch_prediction_url(budget_id)
+        response = get_model_client().post(url, json=raw_data)
+        response.raise_for_status()
+        return response.json()
+
+    def _get_model_cache(self):
+        """
+        Get the ModelCache for in process inference. Models are loaded on their first
+        prediction. Whenever new models are deployed, the changed models are reloaded
+        in the background, requests keep using the old models until then
+        """
+        # Import here, the transactions server only needs mlflow and sklearn if
+        # models are loaded in process
+        from model_selection.model_cache import ModelCache
+
+        if self._model_cache is None:
+            self._model_cache = ModelCache()
+        self._model_cache.reload_if_changed()
+        return self._model_cache
 
     def _get_client(self):
         """
@@ -2,13 +2,73 @@ if __name__ == "__main__":
     pass
 import json
 import os.path
+import signal
 import threading
 
-from flask import Flask, request
+from flask import Flask, request, jsonify
 
-from helpers.helpers import get_bunq_connector, get_config, TRANSACTIONS_SERVER_PORT
+from bunq_ynab_connector.webhook_queue import WebhookQueue
+from helpers.bounded_executor import BoundedExecutor
+from helpers.cache import warm, get_cache_stats
+from helpers.exceptions import YnabAccountNotFoundException
+from helpers.helpers import (
+    get_bunq_connector,
+    get_config,
+    get_ynab_connector,
+    log,
+    TRANSACTIONS_SERVER_PORT,
+)
+
+# Gunicorn is only available on unix. If it is not installed, fall back to the flask
+# development server
+try:
+    from gunicorn.app.base import BaseApplication
+except ImportError:
+    BaseApplication = None
+
+# Defaults, can be overridden in the config
+SERVER_WORKERS = 2
+SERVER_THREADS = 8
+TRANSACTION_WORKERS = 4
+MAX_QUEUED_TRANSACTIONS = 500
+# Seconds to wait for running transactions on shutdown
+DRAIN_TIMEOUT = 60
+# Seconds between polls of the webhook queue, for retries and leftovers
+QUEUE_POLL_INTERVAL = 10
 
 app = Flask(__name__)
+# Created per process, see get_transaction_executor() and get_webhook_queue()
+_transaction_executor = None
+_transaction_executor_lock = threading.Lock()
+_webhook_queue = None
+# Set on shutdown, consumers stop after their current transaction
+_stopping = threading.Event()
+# Failures that a retry cannot fix, eg an iban that is not mapped to an account
+NON_RETRYABLE_EXCEPTIONS = (YnabAccountNotFoundException,)
+
+
+def get_webhook_queue() -> WebhookQueue:
+    """
+    Get the WebhookQueue as singleton per process
+    """
+    global _webhook_queue
+    if _webhook_queue is None:
+        _webhook_queue = WebhookQueue()
+    return _webhook_queue
+
+
+def get_transaction_executor() -> BoundedExecutor:
+    """
+    Get the executor that processes transactions, as singleton per process
+    """
+    global _transaction_executor
+    with _transaction_executor_lock:
+        if _transaction_executor is None:
+            _transaction_executor = BoundedExecutor(
+                get_config("transaction_workers", TRANSACTION_WORKERS),
+                get_config("max_queued_transactions", MAX_QUEUED_TRANSACTIONS),
+            )
+        return _transaction_executor
 
 
 @app.route("/receive-transaction", methods=["GET", "POST"])
@@ -21,12 +81,42 @@ def receive_transaction():
     Run in thread, such that we return 200 immediately. Otherwise return takes to
     long, hence _bunq doesnt receive it, hence it will re-run the callback 5 times,
     resulting in multiple _ynab transactions
+
+    # B:
+    Before returning 200, persist the webhook in the WebhookQueue. If this fails,
+    bunq receives an error and will retry. Redeliveries of a payment are ignored.
+    Then notify a consumer from the bounded pool. If the pool is full, the webhook
+    is picked up by the next poll of the queue
     """
     transaction = json.loads(request.data.decode())
-    threading.Thread(target=process_transaction, args=(transaction,)).start()
+    try:
+        payment_id = transaction["NotificationUrl"]["object"]["Payment"]["id"]
+    except (KeyError, TypeError):
+        log(f"Ignoring callback without payment: {transaction}")
+        return "OK", 200
+    if not get_webhook_queue().enqueue(payment_id, transaction):
+        log(f"Payment {payment_id} was received before, ignoring it")
+        return "OK", 200
+    get_transaction_executor().submit(process_queued_transactions)
     return "OK", 200
 
 
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """
+    Nr of webhooks per status in the queue, queue depth and counters of the
+    transaction executor of this process, and the cache counters
+    """
+    return jsonify(
+        {
+            "pid": os.getpid(),
+            "webhooks": get_webhook_queue().counts(),
+            "transactions": get_transaction_executor().metrics(),
+            "cache": get_cache_stats(),
+        }
+    )
+
+
 def process_transaction(transaction):
     """
     Process a transaction, by claled add_transaction on _bunq
@@ -34,9 +124,84 @@ def process_transaction(transaction):
     get_bunq_connector().add_transaction(transaction)
 
 
+def process_queued_transactions():
+    """
+    Claim and process webhooks from the queue, until it is empty or we are stopping.
+    Failed webhooks are retried later, or moved to the dead letters. Webhooks that
+    fail with one of NON_RETRYABLE_EXCEPTIONS are moved to the dead letters at once
+    """
+    queue = get_webhook_queue()
+    while not _stopping.is_set():
+        webhook = queue.claim()
+        if webhook is None:
+            return
+        payment_id, transaction = webhook
+        try:
+            process_transaction(transaction)
+            queue.complete(payment_id)
+        except Exception as e:
+            retryable = not isinstance(e, NON_RETRYABLE_EXCEPTIONS)
+            is_dead = queue.fail(payment_id, str(e), retryable)
+            log(f"Payment {payment_id} not added (dead: {is_dead}) - {e}", True)
+
+
+def poll_webhook_queue():
+    """
+    Periodically notify a consumer, such that webhooks that are due for a retry, or
+    that could not be handed to the pool directly, are processed as well
+    """
+    while not _stopping.wait(QUEUE_POLL_INTERVAL):
+        get_transaction_executor().submit(process_queued_transactions)
+
+
+def start_background_threads():
+    """
+    Start warming the caches, and polling the webhook queue. Called once per process.
+    Ynab calls of this process don't wait long for the rate limit, failed webhooks
+    are retried by the queue
+    """
+    ynab = get_ynab_connector()
+    ynab.max_wait = ynab.WEBHOOK_MAX_WAIT
+    threading.Thread(target=warm_caches, daemon=True).start()
+    threading.Thread(target=poll_webhook_queue, daemon=True).start()
+
+
+def warm_caches():
+    """
+    Refresh the cached bunq and ynab data that is used for each transaction, such that
+    the first webhooks don't have to wait for the api calls
+    """
+    try:
+        bunq, ynab = get_bunq_connector(), get_ynab_connector()
+        warm(bunq.get_bunq_accounts)
+        budgets = warm(ynab.get_budgets)
+        warm(ynab.get_ynab_accounts)
+        for budget in budgets:
+            warm(ynab.get_categories, budget.id)
+        log("Caches warmed")
+    except Exception as e:
+        log(f"Could not warm caches: {e}", True)
+
+
+def drain_transactions():
+    """
+    Wait until the transactions that are being processed by this process are done.
+    Called on shutdown, after the server stopped accepting requests. Webhooks that
+    are still queued are persisted, and processed after the restart
+    """
+    _stopping.set()
+    if _transaction_executor is None:
+        return
+    log(f"Draining transactions: {_transaction_executor.metrics()}")
+    _transaction_executor.shutdown()
+    log("Transactions drained")
+
+
 def run():
     """
-    Run the flask app indefinitely
+    Run the app indefinitely. Use gunicorn if it is installed, with 'server_workers'
+    processes of 'server_threads' threads each. Otherwise use the flask development
+    server
     """
     # Create it once. Hereby we make sure we have _check_callbacks()'d once
     tmp = get_bunq_connector()
@@ -47,8 +212,55 @@ def run():
             for f in cfg["ssl_context"]
         ]
     )
+    if BaseApplication is None:
+        _run_development_server(cfg, ssl_context)
+    else:
+        _run_production_server(cfg, ssl_context)
+
+
+def _run_development_server(cfg, ssl_context):
+    """
+    Run the flask development server. On SIGTERM, drain the transactions before
+    exiting
+    """
+    log("Gunicorn is not installed, running the development server", True)
+    start_background_threads()
+
+    def stop(signum, frame):
+        drain_transactions()
+        raise SystemExit(0)
+
+    signal.signal(signal.SIGTERM, stop)
     app.run(
         host=cfg["host"],
         port=TRANSACTIONS_SERVER_PORT,
         ssl_context=ssl_context,
     )
+
+
+def _run_production_server(cfg, ssl_context):
+    """
+    Run the app with gunicorn. Each worker process starts its background threads
+    after it is forked, and drains its transactions when it exits
+    """
+
+    class TransactionsServer(BaseApplication):
+        def load_config(self):
+            options = {
+                "bind": f"{cfg['host']}:{TRANSACTIONS_SERVER_PORT}",
+                "workers": cfg.get("server_workers", SERVER_WORKERS),
+                "worker_class": "gthread",
+                "threads": cfg.get("server_threads", SERVER_THREADS),
+                "certfile": ssl_context[0],
+                "keyfile": ssl_context[1],
+                "graceful_timeout": DRAIN_TIMEOUT,
+                "post_worker_init": lambda worker: start_background_threads(),
+                "worker_exit": lambda server, worker: drain_transactions(),
+            }
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return app
+
+    TransactionsServer().run()
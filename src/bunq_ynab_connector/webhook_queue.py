@@ -0,0 +1,188 @@
+import json
+import sqlite3
+from contextlib import closing
+from time import time
+from typing import Dict, List, Optional, Tuple
+
+from _setup.load_config import CONFIG_DIR
+
+WEBHOOK_QUEUE_FILE = f"{CONFIG_DIR}/webhooks.sqlite"
+
+
+class WebhookQueue:
+    """
+    Durable queue of received bunq webhooks, in SQLite (WAL mode), such that no
+    transaction is lost if processing fails or the process dies. It is saved in the
+    config dir, which survives container rebuilds.
+
+    Webhooks are keyed on the bunq payment id, hence redeliveries of a payment that
+    is queued, being processed or processed are ignored. Each webhook has a status:
+    - queued: waiting to be processed, from available_at
+    - processing: claimed by a consumer, until available_at. If the consumer died,
+    the webhook can be claimed again after that
+    - done: processed successfully
+    - dead: failed MAX_ATTEMPTS times. It is copied into the dead_letters table, from
+    which it can be replayed
+    """
+
+    MAX_ATTEMPTS = 5
+    # Seconds to wait before retrying a failed webhook, multiplied by attempts
+    RETRY_DELAY = 30
+    # Seconds after which a claimed webhook is considered abandoned
+    PROCESSING_TIMEOUT = 10 * 60
+
+    path: str
+
+    def __init__(self, path: str = WEBHOOK_QUEUE_FILE):
+        self.path = path
+        with closing(self._connect()) as connection, connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS webhooks ("
+                "payment_id INTEGER PRIMARY KEY, data TEXT, status TEXT, "
+                "attempts INTEGER, last_error TEXT, received_at REAL, "
+                "available_at REAL)"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS webhooks_status "
+                "ON webhooks (status, available_at)"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS dead_letters ("
+                "payment_id INTEGER PRIMARY KEY, data TEXT, attempts INTEGER, "
+                "last_error TEXT, failed_at REAL)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        # One connection per call, the queue is used from multiple threads and
+        # processes. Autocommit mode, transactions are started explicitly
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def enqueue(self, payment_id: int, data: Dict) -> bool:
+        """
+        Persist a webhook. Return False if the payment was already received
+        """
+        now = time()
+        with closing(self._connect()) as connection:
+            cursor = connection.execute(
+                "INSERT OR IGNORE INTO webhooks "
+                "VALUES (?, ?, 'queued', 0, NULL, ?, ?)",
+                (payment_id, json.dumps(data), now, now),
+            )
+            return cursor.rowcount == 1
+
+    def claim(self) -> Optional[Tuple[int, Dict]]:
+        """
+        Claim the oldest available webhook, by setting its status to processing.
+        Return (payment_id, data), or None if no webhook is available
+        """
+        now = time()
+        with closing(self._connect()) as connection:
+            # Lock the database for writing, such that no other consumer can claim
+            # the same webhook
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = connection.execute(
+                    "SELECT payment_id, data FROM webhooks "
+                    "WHERE status IN ('queued', 'processing') AND available_at <= ? "
+                    "ORDER BY received_at LIMIT 1",
+                    (now,),
+                ).fetchone()
+                if row is not None:
+                    connection.execute(
+                        "UPDATE webhooks SET status = 'processing', available_at = ? "
+                        "WHERE payment_id = ?",
+                        (now + self.PROCESSING_TIMEOUT, row[0]),
+                    )
+                connection.execute("COMMIT")
+            except Exception:
+                connection.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        return row[0], json.loads(row[1])
+
+    def complete(self, payment_id: int) -> None:
+        with closing(self._connect()) as connection:
+            connection.execute(
+                "UPDATE webhooks SET status = 'done' WHERE payment_id = ?",
+                (payment_id,),
+            )
+
+    def fail(self, payment_id: int, error: str, retryable: bool = True) -> bool:
+        """
+        Register a failed attempt. Requeue the webhook with a delay, or move it to the
+        dead letters if it failed MAX_ATTEMPTS times, or if the failure is not
+        retryable. Return True if it is dead
+        """
+        now = time()
+        with closing(self._connect()) as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                data, attempts = connection.execute(
+                    "SELECT data, attempts + 1 FROM webhooks WHERE payment_id = ?",
+                    (payment_id,),
+                ).fetchone()
+                is_dead = not retryable or attempts >= self.MAX_ATTEMPTS
+                connection.execute(
+                    "UPDATE webhooks SET status = ?, attempts = ?, last_error = ?, "
+                    "available_at = ? WHERE payment_id = ?",
+                    (
+                        "dead" if is_dead else "queued",
+                        attempts,
+                        error,
+                        now + self.RETRY_DELAY * attempts,
+                        payment_id,
+                    ),
+                )
+                if is_dead:
+                    connection.execute(
+                        "INSERT OR REPLACE INTO dead_letters VALUES (?, ?, ?, ?, ?)",
+                        (payment_id, data, attempts, error, now),
+                    )
+                connection.execute("COMMIT")
+            except Exception:
+                connection.execute("ROLLBACK")
+                raise
+        return is_dead
+
+    def replay_dead_letters(self, payment_ids: List[int] = None) -> int:
+        """
+        Requeue dead webhooks, with their attempts reset. If payment_ids is None,
+        replay all of them. Return the nr of requeued webhooks
+        """
+        with closing(self._connect()) as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            requeued = 0
+            try:
+                if payment_ids is None:
+                    payment_ids = [
+                        row[0]
+                        for row in connection.execute(
+                            "SELECT payment_id FROM dead_letters"
+                        )
+                    ]
+                for payment_id in payment_ids:
+                    requeued += connection.execute(
+                        "UPDATE webhooks SET status = 'queued', attempts = 0, "
+                        "available_at = ? WHERE payment_id = ? AND status = 'dead'",
+                        (time(), payment_id),
+                    ).rowcount
+                    connection.execute(
+                        "DELETE FROM dead_letters WHERE payment_id = ?", (payment_id,)
+                    )
+                connection.execute("COMMIT")
+            except Exception:
+                connection.execute("ROLLBACK")
+                raise
+        return requeued
+
+    def counts(self) -> Dict[str, int]:
+        """
+        Get the nr of webhooks per status
+        """
+        with closing(self._connect()) as connection:
+            rows = connection.execute(
+                "SELECT status, COUNT(*) FROM webhooks GROUP BY status"
+            ).fetchall()
+        return {"queued": 0, "processing": 0, "done": 0, "dead": 0, **dict(rows)}
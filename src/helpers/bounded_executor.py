@@ -0,0 +1,100 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+from helpers.helpers import log
+
+
+class BoundedExecutor:
+    """
+    Thread pool with a bounded queue. If max_workers tasks are running and
+    max_queue_size tasks are waiting, submit() rejects new tasks instead of queueing
+    them, such that bursts cannot exhaust memory or threads
+
+    ATTRIBUTES
+    ----------
+    queued: int
+        Nr of tasks waiting for a thread
+    active: int
+        Nr of tasks running
+    completed: int
+        Nr of tasks that finished without exception
+    failed: int
+        Nr of tasks that raised an exception
+    rejected: int
+        Nr of tasks that were rejected because the queue was full
+    """
+
+    queued: int
+    active: int
+    completed: int
+    failed: int
+    rejected: int
+
+    def __init__(self, max_workers: int, max_queue_size: int):
+        self.max_workers = max_workers
+        self.max_queue_size = max_queue_size
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue_size)
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.active = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def submit(self, func: Callable, *args: Any) -> bool:
+        """
+        Run func(*args) in the pool. Return False if the task was rejected
+        """
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            return False
+        with self._lock:
+            self.queued += 1
+        try:
+            self._executor.submit(self._run, func, *args)
+        except RuntimeError:
+            # The executor is shutting down
+            with self._lock:
+                self.queued -= 1
+                self.rejected += 1
+            self._slots.release()
+            return False
+        return True
+
+    def _run(self, func: Callable, *args: Any) -> None:
+        with self._lock:
+            self.queued -= 1
+            self.active += 1
+        try:
+            func(*args)
+            with self._lock:
+                self.completed += 1
+        except Exception as e:
+            log(f"Task {func.__name__} failed: {e}", True)
+            with self._lock:
+                self.failed += 1
+        finally:
+            with self._lock:
+                self.active -= 1
+            self._slots.release()
+
+    def metrics(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "max_queue_size": self.max_queue_size,
+                "queued": self.queued,
+                "active": self.active,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+            }
+
+    def shutdown(self) -> None:
+        """
+        Stop accepting tasks, and wait until all queued and running tasks are done
+        """
+        self._executor.shutdown(wait=True)
@@ -1,38 +1,299 @@
+import os
 import shelve
+import threading
+from collections import OrderedDict
 from functools import wraps
-from time import time
-import os
+from time import time, perf_counter
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+from helpers.helpers import log
+
+CACHE_DIR = f"{os.path.dirname(__file__)}/../../cache"
+# Max nr of entries kept in the in-process memory tier, over all namespaces
+MEMORY_CACHE_SIZE = 256
+
 
-def cache(ttl: int = None):
+class CacheStats:
     """
-    Cache decorator, to cache the result of a function for some seconds
-    :param ttl: Time to live of cache in seconds
-    args
+    Counters of a single cache namespace (one namespace per decorated function)
+
+    ATTRIBUTES
+    ----------
+    memory_hits: int
+        Nr of lookups served by the in-process memory tier
+    disk_hits: int
+        Nr of lookups served by the on-disk shelve store
+    stale_hits: int
+        Nr of lookups served with an expired value, while refreshing in background
+    misses: int
+        Nr of lookups for which the function had to be called
+    lookup_time: float
+        Total seconds spent looking up values in the memory and disk tiers
+    load_time: float
+        Total seconds spent calling the function on a miss
+    """
+
+    memory_hits: int
+    disk_hits: int
+    stale_hits: int
+    misses: int
+    lookup_time: float
+    load_time: float
+
+    def __init__(self):
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.lookup_time = 0.0
+        self.load_time = 0.0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "lookup_time": self.lookup_time,
+            "load_time": self.load_time,
+        }
+
+
+class MemoryCache:
+    """
+    Bounded LRU dict, shared by all decorated functions in this process. Each entry
+    holds its own expiry timestamp. Values are shared between callers, hence they
+    should not be mutated
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries: "OrderedDict[Hashable, Tuple[Any, Optional[float]]]" = (
+            OrderedDict()
+        )
+        self._lock = threading.RLock()
+
+    def get(self, key: Hashable) -> Optional[Tuple[Any, Optional[float]]]:
+        """
+        Get the (value, expires_at) tuple of a key, or None if it is not cached
+        """
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def set(self, key: Hashable, value: Any, expires_at: Optional[float]) -> None:
+        """
+        Save a value, evict the least recently used entry if we exceed max_size
+        """
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: Hashable) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+class DiskCache:
+    """
+    On-disk tier. One shelve file per namespace, in which each key holds a dict with
+    the value and its expiry timestamp. The shelve is only opened on a memory miss,
+    and closed directly after, such that other processes see our writes
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._locks: Dict[str, threading.Lock] = {}
+        self._locks_lock = threading.Lock()
+
+    def _lock(self, namespace: str) -> threading.Lock:
+        with self._locks_lock:
+            if namespace not in self._locks:
+                self._locks[namespace] = threading.Lock()
+            return self._locks[namespace]
+
+    def _path(self, namespace: str) -> str:
+        return f"{self.directory}/{namespace}"
+
+    def get(self, namespace: str, key: str) -> Optional[Tuple[Any, Optional[float]]]:
+        """
+        Get the (value, expires_at) tuple of a key, or None if it is not cached
+        """
+        with self._lock(namespace), shelve.open(self._path(namespace)) as store:
+            if key not in store:
+                return None
+            entry = store[key]
+            return entry["value"], entry["expires_at"]
+
+    def set(
+        self, namespace: str, key: str, value: Any, expires_at: Optional[float]
+    ) -> None:
+        with self._lock(namespace), shelve.open(self._path(namespace)) as store:
+            store[key] = {"value": value, "expires_at": expires_at}
+
+    def delete(self, namespace: str, key: str) -> None:
+        with self._lock(namespace), shelve.open(self._path(namespace)) as store:
+            if key in store:
+                del store[key]
+
+
+_memory_cache = MemoryCache(MEMORY_CACHE_SIZE)
+_disk_cache = DiskCache(CACHE_DIR)
+_stats: Dict[str, CacheStats] = {}
+
+
+def get_cache_stats() -> Dict[str, Dict[str, Any]]:
+    """
+    Get the counters of all cache namespaces, as dict of namespace -> counters
+    """
+    return {namespace: stats.as_dict() for namespace, stats in _stats.items()}
+
+
+def _is_expired(expires_at: Optional[float]) -> bool:
+    return expires_at is not None and expires_at < time()
+
+
+def _make_key(args: tuple, kwargs: dict) -> str:
+    """
+    Build the cache key of a call. The first argument (self) is not part of the key
+    """
+    return str(args[1:]) + str(tuple(sorted(kwargs.items())))[1:-1]
+
+
+def _unwrap(func) -> Tuple[Any, Any]:
+    """
+    Split a decorated function or bound method into (wrapper, self). self is None
+    if func is not bound
+    """
+    wrapper = getattr(func, "__func__", func)
+    if not hasattr(wrapper, "cache_namespace"):
+        raise ValueError(f"{func} is not decorated with @cache")
+    return wrapper, getattr(func, "__self__", None)
+
+
+def invalidate(func, *args, **kwargs) -> None:
+    """
+    Remove the cached value of func(*args, **kwargs) from both tiers. func is either
+    the decorated function or a bound method; args exclude self
+    """
+    wrapper, _ = _unwrap(func)
+    namespace = wrapper.cache_namespace
+    key = _make_key((None, *args), kwargs)
+    _memory_cache.delete((namespace, key))
+    _disk_cache.delete(namespace, key)
+
+
+def warm(func, *args, background: bool = False, **kwargs) -> Optional[Any]:
+    """
+    (Re)compute func(*args, **kwargs) and save it in both tiers, regardless of whether
+    a valid value is cached. func must be a bound method, as it is called.
+    :param background: If True, refresh in a background thread and return None
+    """
+    wrapper, obj = _unwrap(func)
+    if obj is None:
+        raise ValueError(f"Cannot warm {func}, it should be a bound method")
+    if background:
+        wrapper.refresh_in_background(obj, *args, **kwargs)
+        return None
+    return wrapper.refresh(obj, *args, **kwargs)
+
+
+def cache(ttl: int = None, stale_while_revalidate: bool = True):
+    """
+    Cache decorator, to cache the result of a function for some seconds.
+    Values are cached in two tiers:
+    - An in-process LRU dict, such that hot paths only need a dict lookup
+    - A shelve file per function, such that values survive restarts and are shared
+    between processes
+    :param ttl: Time to live of each entry in seconds, counted from the moment it is
+    written. None means it never expires
+    :param stale_while_revalidate: If True, an expired value is returned directly,
+    while a background thread refreshes it. If False, expired values are recomputed
+    before returning
     """
-    expires_at = time() + ttl
 
     def decorator(func):
+        namespace = func.__qualname__
+        stats = _stats.setdefault(namespace, CacheStats())
+        # Keys that are currently being refreshed in a background thread
+        refreshing = set()
+        refreshing_lock = threading.Lock()
+
+        def refresh(*args, **kwargs):
+            """
+            Call the function, save its result in both tiers
+            """
+            key = _make_key(args, kwargs)
+            start = perf_counter()
+            value = func(*args, **kwargs)
+            stats.load_time += perf_counter() - start
+            expires_at = time() + ttl if ttl is not None else None
+            _memory_cache.set((namespace, key), value, expires_at)
+            _disk_cache.set(namespace, key, value, expires_at)
+            return value
+
+        def refresh_in_background(*args, **kwargs):
+            """
+            Refresh in a daemon thread, unless this key is already being refreshed
+            """
+            key = _make_key(args, kwargs)
+            with refreshing_lock:
+                if key in refreshing:
+                    return
+                refreshing.add(key)
+
+            def target():
+                try:
+                    refresh(*args, **kwargs)
+                except Exception as e:
+                    # Keep serving the stale value, retry on the next lookup
+                    log(f"Could not refresh cache of {namespace}: {e}", True)
+                finally:
+                    with refreshing_lock:
+                        refreshing.discard(key)
+
+            threading.Thread(target=target, daemon=True).start()
+
         @wraps(func)
         def wrapper(*args, **kwargs):
-            key = str(args[1:]) + str(tuple(sorted(kwargs.items())))[1:-1]
-            c = shelve.open(
-                f"{os.path.dirname(__file__)}/../../cache/{func.__name__}_{key}"
-            )
-            is_expired = (
-                "expires_at" in c
-                and c["expires_at"] is not None
-                and c["expires_at"] < time()
-            )
-            cache_valid = not is_expired and "value" in c
-            if not cache_valid:
-                value = func(*args, **kwargs)
-                c["value"] = value
-                c["expires_at"] = expires_at
-            else:
-                value = c["value"]
-            c.close()
-            return value
+            key = _make_key(args, kwargs)
+            memory_key = (namespace, key)
+            start = perf_counter()
+
+            entry = _memory_cache.get(memory_key)
+            if entry is None:
+                entry = _disk_cache.get(namespace, key)
+                if entry is not None:
+                    _memory_cache.set(memory_key, *entry)
+                    if not _is_expired(entry[1]):
+                        stats.disk_hits += 1
+                        stats.lookup_time += perf_counter() - start
+                        return entry[0]
+            elif not _is_expired(entry[1]):
+                stats.memory_hits += 1
+                stats.lookup_time += perf_counter() - start
+                return entry[0]
+            stats.lookup_time += perf_counter() - start
+
+            if entry is not None and stale_while_revalidate:
+                stats.stale_hits += 1
+                refresh_in_background(*args, **kwargs)
+                return entry[0]
+            stats.misses += 1
+            return refresh(*args, **kwargs)
 
+        wrapper.cache_namespace = namespace
+        wrapper.cache_stats = stats
+        wrapper.refresh = refresh
+        wrapper.refresh_in_background = refresh_in_background
         return wrapper
 
     return decorator
@@ -1,2 +1,10 @@
 class YnabAccountNotFoundException(Exception):
     pass
+
+
+class CircuitOpenException(Exception):
+    pass
+
+
+class RateLimitExceededException(Exception):
+    pass
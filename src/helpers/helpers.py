@@ -2,9 +2,10 @@ import datetime
 import json
 import os
 import pickle
+from concurrent.futures import ThreadPoolExecutor
 from functools import wraps
 from time import sleep
-from typing import List, Any, Optional
+from typing import List, Any, Optional, Callable, Iterable
 from pathlib import Path
 
 from _setup.load_config import CONFIG_DIR, CONFIG_FILE
@@ -16,8 +17,15 @@ FLASK_LOG_FILE = "../../logs/flask.log"
 MLFLOW_INITIALIZATION_FILE = "/mlflow_initialized"
 RESTART_MODEL_SERVING_FILE = "/restart_serving"
 TRANSACTIONS_SERVER_PORT = 9888
+# Nr of threads used to load data from the apis. Can be overridden in the config
+DATA_LOADING_WORKERS = 8
 _bunq_connector = None
 _ynab_connector = None
+_model_client = None
+# (mtime, size) of the model port file, and the port it contained
+_model_port_registry = {"stat": None, "port": None}
+# Default of get_config when no default is given, None is a valid default
+_MISSING = object()
 
 
 def log(msg, error=False, with_divider=False):
@@ -50,38 +58,71 @@ def setup_needed() -> bool:
     """
     return not os.path.exists(CONFIG_DIR)
 
+def normalize_iban(iban: Optional[str]) -> Optional[str]:
+    """
+    Normalize an iban to be used as lookup key: strip all whitespace, uppercase
+    """
+    if iban is None:
+        return None
+    return "".join(iban.split()).upper()
+
+
 def get_prediction_url(budget_id: str):
     """
     Get the url to POST to, to get the category prediction of a transaction for a
     budget:
-    - Load the port on which the server that servers the model for this budget resides
-    - Load the url
+    - Load the port on which the ModelServer that serves the models resides
+    - Load the url of the budget
     - return it
     """
-    port = get_model_port(budget_id)
-    url = f"http://localhost:{port}/predict"
+    port = get_model_port()
+    url = f"http://localhost:{port}/predict/{budget_id}"
     return url
 
 
+def get_batch_prediction_url(budget_id: str):
+    """
+    Get the url to POST to, to get the category predictions of a list of transactions
+    for a budget
+    """
+    return f"{get_prediction_url(budget_id)}/batch"
 
 
+def get_model_port() -> Optional[int]:
+    """
+    Get the port on which the models are currently being served. The port is set
+    whenever the ModelServer is served()'d. The port is kept in memory, the file is
+    only read again if its mtime or size changed
+    """
+    stat = os.stat(MODEL_PORT_FILE)
+    stat = (stat.st_mtime_ns, stat.st_size)
+    if _model_port_registry["stat"] != stat:
+        with open(MODEL_PORT_FILE, "r") as file:
+            port = json.load(file).get("gateway")
+        _model_port_registry.update(stat=stat, port=port)
+    return _model_port_registry["port"]
+
 
-def get_model_port(budget_id: str) -> Optional[int]:
+def get_model_client():
     """
-    Get the port on which a model is currently being served. The port is set whenever
-    the ModelServer is served()'d
+    Get the HttpClient used to call the ModelServer, as singleton. Its connections
+    are kept alive between predictions
     """
-    with open(MODEL_PORT_FILE, "r+") as file:
-        ports = json.load(file)
-        if budget_id not in ports:
-            return None
-        return ports[budget_id]
+    from helpers.http_client import HttpClient
 
+    global _model_client
+    if _model_client is None:
+        _model_client = HttpClient(
+            read_timeout=get_config("model_timeout", HttpClient.READ_TIMEOUT)
+        )
+    return _model_client
 
-def get_config(key=None):
+
+def get_config(key=None, default=_MISSING):
     """
     Load config json file. If key is provided, return only that value. Otherwise the
-    complete dict
+    complete dict. If the key does not exist and a default is provided (which may be
+    None), return the default, else raise KeyError
     """
     if setup_needed():
         print("Please run the setup script: python setup.py")
@@ -90,10 +131,28 @@ def get_config(key=None):
     with open(CONFIG_FILE) as file:
         cfg = json.load(file)
         if key is not None:
+            if default is not _MISSING:
+                return cfg.get(key, default)
             return cfg[key]
         return cfg
 
 
+def parallel_map(func: Callable, items: Iterable, max_workers: int = None) -> List:
+    """
+    Map func over items using a thread pool. Results are returned in order of items,
+    exceptions are re-raised
+    Parameters
+    ----------
+    max_workers: int = None
+        Nr of threads. Defaults to the 'data_loading_workers' config value
+    """
+    max_workers = max_workers or get_config(
+        "data_loading_workers", DATA_LOADING_WORKERS
+    )
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(func, items))
+
+
 def get_bunq_connector():
     """
     Get the BunqConnector as singleton
@@ -122,19 +181,35 @@ def load_datasets() -> List:
     from model_selection.dataset import Dataset
 
     """
-    Load all datasets, one for each budget
+    Load all datasets, one for each budget:
+    - Load the info of all budgets in parallel
+    - Sync the transaction histories of all bunq accounts and ynab budgets in
+    parallel. The api calls are bounded by the rate limiters of the connectors
+    - Build the datasets in parallel, they now only read the local stores
     """
     log("Loading datasets")
+    bunq, ynab = get_bunq_connector(), get_ynab_connector()
+    # Load the accounts once, instead of concurrently in each budget
+    ynab.get_ynab_accounts()
+    budgets = parallel_map(lambda b: b.load_info(), ynab.get_budgets())
+
+    bunq_accounts = bunq.get_bunq_account_index()
+    bunq_account_ids = {
+        bunq_accounts[iban].id
+        for iban in (normalize_iban(a.iban) for b in budgets for a in b.accounts)
+        if iban in bunq_accounts
+    }
+    parallel_map(bunq.sync_transactions, bunq_account_ids)
+    parallel_map(ynab.sync_transactions, [b.id for b in budgets])
+    log("Synced all transactions")
+
     datasets = []
-    budgets = get_ynab_connector().get_budgets()
-    for budget in budgets:
-        # Remove below on production
-        dataset = Dataset(budget.load_info())
+    for dataset in parallel_map(Dataset, budgets):
         if not dataset.is_valid:
             log(f"Skipping invalid dataset {dataset.budget.id}")
         else:
             datasets.append(dataset)
-            log(f"Dataset loaded for budget {budget.id}")
+            log(f"Dataset loaded for budget {dataset.budget.id}")
     log("Finished loading datasets")
     return datasets
 
@@ -195,7 +270,14 @@ def get_mlflow_model_name(dataset) -> str:
     """
     Get the name under which to deploy the model for this dataset
     """
-    return f"Classifier for Budget {dataset.budget.id}"
+    return get_mlflow_model_name_for_budget(dataset.budget.id)
+
+
+def get_mlflow_model_name_for_budget(budget_id: str) -> str:
+    """
+    Get the name under which the model for this budget is deployed
+    """
+    return f"Classifier for Budget {budget_id}"
 
 
 def mlflow_is_initialized():
@@ -0,0 +1,161 @@
+import threading
+from time import monotonic
+from typing import Dict
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from helpers.exceptions import CircuitOpenException
+
+
+class CircuitBreaker:
+    """
+    Stops calls to a service that keeps failing. After failure_threshold consecutive
+    failures the circuit opens, and calls are refused for reset_timeout seconds.
+    Then a single trial call is allowed: if it succeeds the circuit closes, else it
+    opens again
+
+    ATTRIBUTES
+    ----------
+    failure_threshold: int
+        Nr of consecutive failures after which the circuit opens
+    reset_timeout: float
+        Seconds the circuit stays open
+    """
+
+    failure_threshold: int
+    reset_timeout: float
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """
+        Whether a call is allowed now
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if monotonic() - self._opened_at < self.reset_timeout:
+                return False
+            # Half open, allow one trial call
+            if self._trial_running:
+                return False
+            self._trial_running = True
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def release(self) -> None:
+        """
+        Neither a success nor a failure, eg the request was invalid. Only ends a
+        trial call
+        """
+        with self._lock:
+            self._trial_running = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            self._trial_running = False
+            if self._failures >= self.failure_threshold:
+                self._opened_at = monotonic()
+
+
+class HttpClient:
+    """
+    Pooled http client for internal services. Uses one session, such that
+    connections are kept alive and reused, applies timeouts to every request, and
+    guards each url (eg the model of one budget) with its own circuit breaker. Only
+    failures that mean the service is unavailable count: connection errors,
+    timeouts and FAILURE_STATUSES. Application errors (eg a 500 because of one bad
+    payment) don't open the circuit
+
+    ATTRIBUTES
+    ----------
+    session: requests.Session
+        The session, with a connection pool of pool_size connections per host
+    timeout: tuple
+        (connect, read) timeout in seconds
+    failure_threshold: int
+        The failure_threshold of each circuit breaker
+    reset_timeout: float
+        The reset_timeout of each circuit breaker
+    circuit_breakers: Dict[str, CircuitBreaker]
+        Per url, refuses requests while it keeps failing
+    """
+
+    POOL_SIZE = 10
+    CONNECT_TIMEOUT = 1
+    READ_TIMEOUT = 5
+    FAILURE_THRESHOLD = 5
+    RESET_TIMEOUT = 30
+    FAILURE_STATUSES = {502, 503, 504}
+
+    session: requests.Session
+    timeout: tuple
+    failure_threshold: int
+    reset_timeout: float
+    circuit_breakers: Dict[str, CircuitBreaker]
+
+    def __init__(
+        self,
+        pool_size: int = POOL_SIZE,
+        connect_timeout: float = CONNECT_TIMEOUT,
+        read_timeout: float = READ_TIMEOUT,
+        failure_threshold: int = FAILURE_THRESHOLD,
+        reset_timeout: float = RESET_TIMEOUT,
+    ):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.timeout = (connect_timeout, read_timeout)
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.circuit_breakers = {}
+        self._lock = threading.Lock()
+
+    def circuit_breaker(self, url: str) -> CircuitBreaker:
+        """
+        Get the circuit breaker of a url, create it on first use
+        """
+        with self._lock:
+            breaker = self.circuit_breakers.get(url)
+            if breaker is None:
+                breaker = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+                self.circuit_breakers[url] = breaker
+            return breaker
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        """
+        Post to url. Raises CircuitOpenException without a request if the circuit
+        of the url is open. The response is returned as is, the caller should check
+        its status
+        """
+        circuit_breaker = self.circuit_breaker(url)
+        if not circuit_breaker.allow():
+            raise CircuitOpenException(f"Circuit open, not posting to {url}")
+        kwargs.setdefault("timeout", self.timeout)
+        try:
+            response = self.session.post(url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout):
+            circuit_breaker.record_failure()
+            raise
+        except requests.RequestException:
+            circuit_breaker.release()
+            raise
+        if response.status_code in self.FAILURE_STATUSES:
+            circuit_breaker.record_failure()
+        else:
+            circuit_breaker.record_success()
+        return response
@@ -0,0 +1,125 @@
+import os
+import sqlite3
+import threading
+from collections import deque
+from contextlib import closing
+from time import monotonic, sleep, time
+from typing import Optional
+
+from helpers.exceptions import RateLimitExceededException
+from helpers.helpers import log
+
+
+class RateLimiter:
+    """
+    Thread-safe sliding window rate limiter: at most max_calls calls in any period of
+    period seconds. acquire() blocks until a call is allowed, or raises
+    RateLimitExceededException if that takes longer than its max_wait
+
+    ATTRIBUTES
+    ----------
+    max_calls: int
+        Max nr of calls within one period
+    period: float
+        Length of the window in seconds
+    """
+
+    max_calls: int
+    period: float
+
+    def __init__(self, max_calls: int, period: float):
+        self.max_calls = max_calls
+        self.period = period
+        self._calls = deque()
+        self._lock = threading.Lock()
+
+    def acquire(self, max_wait: Optional[float] = None) -> None:
+        """
+        Wait until a call is allowed, and register it. Raise if the wait would be
+        longer than max_wait seconds
+        """
+        while True:
+            with self._lock:
+                now = monotonic()
+                while self._calls and self._calls[0] <= now - self.period:
+                    self._calls.popleft()
+                if len(self._calls) < self.max_calls:
+                    self._calls.append(now)
+                    return
+                wait = self._calls[0] + self.period - now
+            if max_wait is not None and wait > max_wait:
+                raise RateLimitExceededException(
+                    f"Rate limit of {self.max_calls} calls per {self.period}s reached, "
+                    f"next call allowed in {wait:.0f}s"
+                )
+            sleep(wait)
+
+
+class SharedRateLimiter(RateLimiter):
+    """
+    Sliding window rate limiter of which the calls are saved in SQLite, hence the
+    limit holds over all processes (eg the gunicorn workers and the training process)
+    that use the same file
+
+    ATTRIBUTES
+    ----------
+    path: str
+        The SQLite file with the registered calls
+    """
+
+    # Waits longer than this nr of seconds are logged
+    LOG_WAIT = 5
+
+    path: str
+
+    def __init__(self, max_calls: int, period: float, path: str):
+        super().__init__(max_calls, period)
+        self.path = path
+        self._initialized = False
+
+    def _connect(self) -> sqlite3.Connection:
+        # One connection per call, autocommit mode, transactions are started
+        # explicitly. The table is created on first use, the limiter is created at
+        # import time
+        if not self._initialized:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        if not self._initialized:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("CREATE TABLE IF NOT EXISTS calls (called_at REAL)")
+            self._initialized = True
+        return connection
+
+    def acquire(self, max_wait: Optional[float] = None) -> None:
+        """
+        Wait until a call is allowed, and register it. Raise if the wait would be
+        longer than max_wait seconds
+        """
+        while True:
+            with closing(self._connect()) as connection:
+                connection.execute("BEGIN IMMEDIATE")
+                try:
+                    now = time()
+                    connection.execute(
+                        "DELETE FROM calls WHERE called_at <= ?", (now - self.period,)
+                    )
+                    count, first = connection.execute(
+                        "SELECT COUNT(*), MIN(called_at) FROM calls"
+                    ).fetchone()
+                    if count < self.max_calls:
+                        connection.execute("INSERT INTO calls VALUES (?)", (now,))
+                        connection.execute("COMMIT")
+                        return
+                    connection.execute("COMMIT")
+                except Exception as e:
+                    connection.execute("ROLLBACK")
+                    raise e
+            wait = first + self.period - now
+            if max_wait is not None and wait > max_wait:
+                raise RateLimitExceededException(
+                    f"Rate limit of {self.max_calls} calls per {self.period}s reached, "
+                    f"next call allowed in {wait:.0f}s"
+                )
+            if wait > self.LOG_WAIT:
+                log(f"Rate limit reached, waiting {wait:.0f}s")
+            sleep(wait)
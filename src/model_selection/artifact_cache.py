@@ -0,0 +1,98 @@
+import hashlib
+import json
+import os
+import threading
+from typing import Any, Dict, Optional
+
+import joblib
+
+from helpers.cache import CACHE_DIR
+from helpers.helpers import log
+
+ARTIFACT_CACHE_DIR = f"{CACHE_DIR}/artifacts"
+
+
+class ArtifactCache:
+    """
+    Local, content-addressed cache of the objects of deployed models. Each object is
+    saved with joblib under the sha256 of its file. Per registered model version and
+    the run that logged it, an index file maps the artifact names to their
+    checksums. The run id is part of the key, such that a recreated registry that
+    reuses a version number never gets the artifacts of another model. A checksum
+    is verified before an object is loaded, a corrupt object is removed and counts
+    as a miss.
+
+    ATTRIBUTES
+    ----------
+    directory: str
+        The directory of the cache. Objects are saved in objects/, indexes in index/
+    mmap: bool
+        If True, numpy arrays in the objects (eg the trees of a RandomForest) are
+        memory-mapped instead of read into memory
+    """
+
+    directory: str
+    mmap: bool
+
+    def __init__(self, directory: str = ARTIFACT_CACHE_DIR, mmap: bool = True):
+        self.directory = directory
+        self.mmap = mmap
+        os.makedirs(f"{directory}/objects", exist_ok=True)
+        os.makedirs(f"{directory}/index", exist_ok=True)
+
+    def load(self, name: str, version: str, run_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Load the objects of a model version, by artifact name. None if the version is
+        not cached, or if any of its objects is corrupt
+        """
+        try:
+            with open(self._index_path(name, version, run_id), "r") as file:
+                checksums = json.load(file)
+        except FileNotFoundError:
+            return None
+        objects = {}
+        for artifact, checksum in checksums.items():
+            path = self._object_path(checksum)
+            if not os.path.exists(path) or self._checksum(path) != checksum:
+                log(f"Cached artifact {artifact} of {name} is corrupt", True)
+                if os.path.exists(path):
+                    os.remove(path)
+                return None
+            objects[artifact] = joblib.load(path, mmap_mode="r" if self.mmap else None)
+        return objects
+
+    def save(
+        self, name: str, version: str, run_id: str, objects: Dict[str, Any]
+    ) -> None:
+        """
+        Save the objects of a model version, by artifact name. The index is written
+        last, hence a version is only cached once all its objects are
+        """
+        checksums = {}
+        for artifact, obj in objects.items():
+            tmp_name = f"{os.getpid()}.{threading.get_ident()}.tmp"
+            tmp_path = f"{self.directory}/objects/{tmp_name}"
+            joblib.dump(obj, tmp_path)
+            checksum = self._checksum(tmp_path)
+            os.replace(tmp_path, self._object_path(checksum))
+            checksums[artifact] = checksum
+        index_path = self._index_path(name, version, run_id)
+        tmp_path = f"{index_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(checksums, file)
+        os.replace(tmp_path, index_path)
+
+    def _index_path(self, name: str, version: str, run_id: str) -> str:
+        key = hashlib.sha256(f"{name}/{version}/{run_id}".encode()).hexdigest()
+        return f"{self.directory}/index/{key}.json"
+
+    def _object_path(self, checksum: str) -> str:
+        return f"{self.directory}/objects/{checksum}"
+
+    @staticmethod
+    def _checksum(path: str) -> str:
+        digest = hashlib.sha256()
+        with open(path, "rb") as file:
+            for block in iter(lambda: file.read(1 << 20), b""):
+                digest.update(block)
+        return digest.hexdigest()
@@ -0,0 +1,211 @@
+import json
+import pickle
+from typing import Dict, List
+
+import mlflow.pyfunc
+import numpy as np
+from bunq.sdk.model.generated.endpoint import Payment
+from mlflow.tracking import MlflowClient
+from scipy import sparse as sp
+from sklearn.base import ClassifierMixin
+from sklearn.preprocessing import LabelEncoder
+
+from bunq_ynab_connector._bunq.bunq_account import BunqAccount
+from helpers.helpers import (
+    get_bunq_connector,
+    get_config,
+    get_mlflow_model_name_for_budget,
+    log,
+)
+from model_selection.artifact_cache import ArtifactCache
+from model_selection.feature_extractor import FeatureExtractor
+from model_selection.model_manifest import ModelManifest
+
+
+class BudgetModel:
+    """
+    The deployed model of a single budget, with the artifacts needed to predict
+
+    ATTRIBUTES
+    ----------
+    budget_id: str
+        The budget this model predicts categories for
+    model: ClassifierMixin
+        The deployed model
+    category_encoder: LabelEncoder
+        The category encoder belonging to the model
+    feature_extractor: FeatureExtractor
+        The feature extractor belonging to the model
+    version: str
+        The registered model version of the model
+    """
+
+    # Dummy payment to warm up a loaded model
+    WARM_UP_PAYMENT = {
+        "description": "",
+        "amount": {"value": "0.00", "currency": "EUR"},
+        "created": "2022-01-01 00:00:00.000000",
+    }
+
+    budget_id: str
+    model: ClassifierMixin
+    category_encoder: LabelEncoder
+    feature_extractor: FeatureExtractor
+    version: str
+
+    def __init__(self, budget_id: str):
+        self.budget_id = budget_id
+
+    def load(self, entry: Dict = None) -> "BudgetModel":
+        """
+        Load the model that was deployed for this budget:
+        - Get the entry of its production version from the model registry. This is
+        the only call to mlflow if the version is cached locally. If the registry
+        cannot be reached, use the entry in the ModelManifest
+        - Load the model, category encoder and feature extractor from the
+        ArtifactCache. If the version is not cached, download them from mlflow and
+        cache them
+        """
+        entry = entry or self._get_entry()
+        cache = ArtifactCache(mmap=get_config("artifact_mmap", True))
+        key = entry["name"], entry["version"], entry["run_id"]
+        objects = cache.load(*key)
+        if objects is None:
+            objects = self._download(entry)
+            cache.save(*key, objects)
+        else:
+            log(f"Loaded model of budget {self.budget_id} from the artifact cache")
+        for name, obj in objects.items():
+            setattr(self, name, obj)
+        self.version = entry["version"]
+        return self
+
+    def _get_entry(self) -> Dict:
+        """
+        Get the entry of the production version, from the registry, or from the
+        ModelManifest if the registry cannot be reached
+        """
+        try:
+            return self.get_production_entry(self.budget_id)
+        except Exception as e:
+            entry = ModelManifest().get(self.budget_id)
+            if entry is None:
+                raise e
+            log(f"Could not check the model version, using the manifest: {e}", True)
+            return entry
+
+    @staticmethod
+    def _download(entry: Dict) -> Dict:
+        """
+        Download the model and its category encoder and feature extractor artifacts
+        from mlflow. Return them by attribute name. Raises if any of them cannot be
+        loaded, such that an incomplete model is never cached
+        """
+        client = MlflowClient()
+        objects = {}
+        for art_name, art_path in entry["artifacts"].items():
+            # Download the artifact to local. Will return the path of the artifact
+            path = client.download_artifacts(entry["run_id"], art_path)
+            # Open it, load it, save it
+            with open(path, "rb") as f:
+                try:
+                    objects[art_name] = pickle.load(f)
+                except Exception as e:
+                    raise Exception(f"Could not load artifact {art_name}: {e}")
+        objects["model"] = mlflow.sklearn.load_model(entry["model_uri"])
+        return objects
+
+    @staticmethod
+    def get_production_entry(budget_id: str) -> Dict:
+        """
+        Get the ModelManifest entry of the production version of the model of a
+        budget, from the model registry
+        """
+        name = get_mlflow_model_name_for_budget(budget_id)
+        versions = MlflowClient().get_latest_versions(name, stages=["Production"])
+        if not versions:
+            raise Exception(f"No model in production for budget {budget_id}")
+        return ModelManifest.entry(versions[0])
+
+    def warm(self) -> None:
+        """
+        Predict once on a dummy payment, such that the first request does not have to
+        build the analyzer of the feature extractor. Raises if the model cannot
+        predict, hence a broken model is never swapped in
+        """
+        self.predict(self.WARM_UP_PAYMENT)
+
+    def predict(self, payment_data: Dict) -> str:
+        """
+        Predict the category of a payment:
+        - Transform the payment dict into features through the fast path of the
+        feature extractor. If this fails (eg the dict is incomplete, or the extractor
+        was pickled before the fast path existed), fall back to the slow path
+        - Predict the code of the category
+        - Convert the catgory code to string, using the label encoder
+        """
+        try:
+            features = self.feature_extractor.transform_raw(payment_data)
+        except Exception:
+            features = self._transform_payment(payment_data)
+        prediction_code = self.model.predict(features)
+        prediction_label = self.category_encoder.inverse_transform(prediction_code)[0]
+        return prediction_label
+
+    def predict_batch(self, payments: List[Dict]) -> List[Dict]:
+        """
+        Predict the categories of a list of payments, in one call:
+        - Transform them in one vectorized call. If this fails, transform them one
+        by one through the slow path
+        - Predict all of them at once, with predict() such that the categories are
+        the same as those of predict(). If the model supports predict_proba, use the
+        probability of the predicted category as confidence, else the confidence is
+        None. For SVC(probability=True), that need not be the highest probability
+        Returns a list, in order of the payments, of dicts with 'category' and
+        'confidence'
+        """
+        if not payments:
+            return []
+        try:
+            features = self.feature_extractor.transform_raw_batch(payments)
+        except Exception:
+            rows = [self._transform_payment(p) for p in payments]
+            features = sp.vstack(rows) if sp.issparse(rows[0]) else np.vstack(rows)
+
+        prediction_codes = self.model.predict(features)
+        # Eg SVC(probability=False) has no predict_proba
+        if hasattr(self.model, "predict_proba"):
+            probabilities = self.model.predict_proba(features)
+            columns = np.searchsorted(self.model.classes_, prediction_codes)
+            confidences = probabilities[np.arange(len(payments)), columns].tolist()
+        else:
+            confidences = [None] * len(payments)
+        labels = self.category_encoder.inverse_transform(prediction_codes)
+        return [
+            {"category": label, "confidence": confidence}
+            for label, confidence in zip(labels.tolist(), confidences)
+        ]
+
+    def _transform_payment(self, payment_data: Dict):
+        """
+        Slow path to transform a payment dict into features:
+        - Create a Payment object from the payment dict. Try to do this by parsing the
+        json. If this fails, load it by calling the api.
+        - Update the payment, by adding the datetime. Otherwise the transformer can
+        transform it
+        - Transform it
+        """
+        try:
+            payment = Payment.from_json(json.dumps(payment_data))
+            log(f"Payment {payment.id_} loaded from json")
+        except:
+            payment_id, monetary_account_id = (
+                payment_data["id"],
+                payment_data["monetary_account_id"],
+            )
+            payment = get_bunq_connector().get_payment(payment_id, monetary_account_id)
+            log(f"Could not load payment {payment_id} by json, loaded it by api call")
+
+        payment = BunqAccount.update_transaction(payment)
+        data = [payment]
+        return self.feature_extractor.transform(data)
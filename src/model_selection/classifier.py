@@ -8,6 +8,7 @@ from sklearn.metrics import accuracy_score, precision_score, f1_score, cohen_kap
 from sklearn.model_selection import ShuffleSplit
 
 from model_selection.dataset import Dataset
+from model_selection.feature_cache import FeatureCache
 from model_selection.feature_extractor import FeatureExtractor
 
 
@@ -36,15 +37,25 @@ class Classifier:
         clf_class = clf.__class__.__name__
         with mlflow.start_run(nested=True, run_name=clf_class):
             # Split
-            X_train, X_test, y_train, y_test = self.split_to_sets(dataset)
-            # Fit
-            clf.fit(X_train, y_train)
-            # Predict and evaluate
-            y_pred = clf.predict(X_test)
-            y_pred = np.array(y_pred, int)
+            X_train, X_test, y_train, y_test = self.split_to_sets(
+                dataset, FeatureExtractor.accepts_sparse(clf)
+            )
+            self.fit_evaluate(clf, X_train, X_test, y_train, y_test)
 
-            self.evaluate(y_test, y_pred)
-            mlflow.sklearn.log_model(clf, clf_class)
+    def fit_evaluate(
+        self, clf, X_train: NDArray, X_test: NDArray, y_train: NDArray, y_test: NDArray
+    ):
+        """
+        Fit a classifier on the train set, evaluate it on the test set, log the metrics
+        and the model to the active mlflow run
+        """
+        clf.fit(X_train, y_train)
+        # Predict and evaluate
+        y_pred = clf.predict(X_test)
+        y_pred = np.array(y_pred, int)
+
+        self.evaluate(y_test, y_pred)
+        mlflow.sklearn.log_model(clf, clf.__class__.__name__)
 
     @classmethod
     def evaluate(
@@ -81,7 +92,7 @@ class Classifier:
 
     @classmethod
     def split_to_sets(
-        cls, dataset: Dataset
+        cls, dataset: Dataset, sparse: bool = True
     ) -> Tuple[NDArray[Payment], NDArray[Payment], NDArray, NDArray]:
         """
         Split a dataset into 1 train,test split, return sets.
@@ -90,13 +101,12 @@ class Classifier:
         - Fit it on the complete X, and transform the train and test Xs
         - Log feature extractor feature names to mlflow. Hence this function only
         works while in an active mlflow run!
+        Parameters
+        ----------
+        sparse: bool
+            If True, the Xs are sparse matrices, else dense arrays. See FeatureExtractor
         """
-        X, y = dataset.X, dataset.y
-
-        # Fit and transform X into features
-        feature_extractor = FeatureExtractor()
-        X = feature_extractor.fit_transform(X, y)
-        X, y = np.array(X), np.array(y)
+        feature_extractor, X, y = cls.extract_features(dataset, sparse)
         # Log features
         mlflow.log_text(",".join(feature_extractor.feature_names()), "features.txt")
 
@@ -108,3 +118,18 @@ class Classifier:
             y[test_idx],
         )
         return X_train, X_test, y_train, y_test
+
+    @classmethod
+    def extract_features(
+        cls, dataset: Dataset, sparse: bool = True
+    ) -> Tuple[FeatureExtractor, NDArray, NDArray]:
+        """
+        Create a feature_extractor, fit it on the complete X and transform X. Return
+        the extractor, the features and the labels. Both are loaded from the
+        FeatureCache if they were computed before
+        """
+        feature_extractor, X = FeatureCache().get(
+            dataset.X, FeatureExtractor.for_budget(dataset.budget.id, sparse)
+        )
+        y = np.array(dataset.y)
+        return feature_extractor, X, y
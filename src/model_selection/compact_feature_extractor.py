@@ -0,0 +1,173 @@
+from bisect import bisect_left
+from collections import Counter
+from datetime import datetime
+from typing import Dict, List, Tuple
+
+import numpy as np
+from numpy.typing import NDArray
+from scipy import sparse as sp
+from sklearn.feature_extraction.text import CountVectorizer
+
+from model_selection.feature_extractor import FeatureExtractor
+
+
+class CompactFeatureExtractor(FeatureExtractor):
+    """
+    Inference-only representation of a fitted FeatureExtractor, for serving. Instead
+    of the TfidfVectorizer with its vocabulary dict, it holds:
+    - The sorted vocabulary as one buffer of concatenated utf-8 encoded terms, and
+    the offset of each term in it. The vectorizer sorts its features too (utf-8
+    preserves that order), hence the position of a term is its column. Terms are
+    looked up with a binary search. Unlike a fixed width array, long terms (eg
+    ibans or references) don't pad all other terms
+    - The idf weights as float32
+    - The parameters that are needed to rebuild the analyzer
+    Transforms to the same features as the extractor it was created from, up to
+    float32 precision. Cannot be fit
+
+    ATTRIBUTES
+    ----------
+    terms: bytes
+        The sorted vocabulary, concatenated utf-8 encoded terms
+    offsets: NDArray
+        int32, the start of each term in terms, followed by the length of terms
+    idf: NDArray
+        The idf weight of each term, float32. None if idf was not used
+    analyzer_params: Dict
+        The parameters of the vectorizer that define its analyzer
+    norm: str
+        The norm of the vectorizer
+    sublinear_tf: bool
+        Whether the vectorizer uses sublinear tf
+    binary: bool
+        Whether the vectorizer uses binary tf
+    """
+
+    terms: bytes
+    offsets: NDArray
+    idf: NDArray
+    analyzer_params: Dict
+    norm: str
+    sublinear_tf: bool
+    binary: bool
+
+    @classmethod
+    def from_feature_extractor(
+        cls, feature_extractor: FeatureExtractor
+    ) -> "CompactFeatureExtractor":
+        encoder = feature_extractor.description_encoder
+        compact = cls(sparse=feature_extractor.sparse)
+        terms = [term.encode() for term in encoder.get_feature_names_out()]
+        compact.terms = b"".join(terms)
+        compact.offsets = np.zeros(len(terms) + 1, dtype=np.int32)
+        np.cumsum([len(term) for term in terms], out=compact.offsets[1:])
+        compact.idf = encoder.idf_.astype(np.float32) if encoder.use_idf else None
+        analyzer_keys = CountVectorizer().get_params().keys() - {"vocabulary", "dtype"}
+        compact.analyzer_params = {
+            key: value
+            for key, value in encoder.get_params().items()
+            if key in analyzer_keys
+        }
+        compact.norm = encoder.norm
+        compact.sublinear_tf = encoder.sublinear_tf
+        compact.binary = encoder.binary
+        return compact
+
+    def fit(self, X, y=None):
+        raise NotImplementedError("A CompactFeatureExtractor cannot be fit")
+
+    def _encode_descriptions(self, descriptions: List[str]) -> sp.csr_matrix:
+        indptr, indices, data = [0], [], []
+        for description in descriptions:
+            word_idx, tf = self._encode(description)
+            indices.append(word_idx)
+            data.append(tf)
+            indptr.append(indptr[-1] + len(word_idx))
+        return sp.csr_matrix(
+            (
+                np.concatenate(data) if data else np.empty(0),
+                np.concatenate(indices) if indices else np.empty(0, dtype=np.int64),
+                indptr,
+            ),
+            shape=(len(descriptions), self.n_terms),
+        )
+
+    def transform_raw(self, payment: Dict) -> NDArray:
+        offset = len(self.COLUMNS)
+        row = np.zeros((1, offset + self.n_terms), dtype=np.float64)
+        created = datetime.fromisoformat(payment["created"])
+        row[0, :offset] = (
+            float(payment["amount"]["value"]),
+            created.hour,
+            created.minute,
+            created.weekday(),
+        )
+        word_idx, tf = self._encode(payment["description"])
+        row[0, word_idx + offset] = tf
+        return row
+
+    def _encode(self, description: str) -> Tuple[NDArray, NDArray]:
+        """
+        Tokenize a description, look the tokens up in the sorted terms, and weight
+        and normalize their counts like the TfidfVectorizer does. Return the columns
+        and values of the description
+        """
+        terms = _Terms(self.terms, self.offsets)
+        counts = Counter()
+        for token in self._get_analyzer()(description):
+            token = token.encode()
+            position = bisect_left(terms, token)
+            if position < len(terms) and terms[position] == token:
+                counts[position] += 1
+        if not counts:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        word_idx = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+        tf = np.fromiter(counts.values(), dtype=np.float64, count=len(counts))
+        if self.binary:
+            tf[:] = 1
+        if self.sublinear_tf:
+            tf = np.log(tf) + 1
+        if self.idf is not None:
+            tf *= self.idf[word_idx]
+        if self.norm == "l2":
+            tf /= np.sqrt(np.dot(tf, tf))
+        elif self.norm == "l1":
+            tf /= np.abs(tf).sum()
+        return word_idx, tf
+
+    def _get_analyzer(self):
+        if getattr(self, "_analyzer", None) is None:
+            self._analyzer = CountVectorizer(**self.analyzer_params).build_analyzer()
+        return self._analyzer
+
+    @property
+    def n_terms(self) -> int:
+        return len(self.offsets) - 1
+
+    def get_feature_names_out(self, input_features=None) -> NDArray:
+        terms = _Terms(self.terms, self.offsets)
+        return np.array(
+            [*self.COLUMNS, *[f"word_{terms[i].decode()}" for i in range(len(terms))]],
+            dtype=object,
+        )
+
+    def feature_names(self) -> List[str]:
+        return [f"description ({self.__class__.__name__})", *self.COLUMNS]
+
+
+class _Terms:
+    """
+    Sequence view of the terms of a CompactFeatureExtractor, such that they can be
+    searched with bisect
+    """
+
+    def __init__(self, terms: bytes, offsets: NDArray):
+        self.terms = terms
+        # Indexing a memoryview gives python ints, much faster than numpy scalars
+        self.offsets = memoryview(offsets)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> bytes:
+        return self.terms[self.offsets[i] : self.offsets[i + 1]]
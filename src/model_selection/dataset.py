@@ -11,7 +11,8 @@ from bunq_ynab_connector._bunq.bunq_account import BunqAccount
 from bunq_ynab_connector._ynab.budget import Budget
 from bunq_ynab_connector._ynab.ynab_account import YnabAccount
 from helpers.cache import cache
-from helpers.helpers import get_bunq_connector
+from helpers.helpers import get_bunq_connector, normalize_iban
+from model_selection.transaction_matcher import TransactionMatcher
 
 
 class Dataset:
@@ -29,8 +30,14 @@ class Dataset:
 
     X: NDArray[Payment]
         Items to classify. Will be transformed into a frame using the FeatureExtractor
+
+    MATCH_WINDOW_DAYS: int
+        Max nr of days a bunq payment and ynab transaction may differ in date to be
+        matched. See TransactionMatcher
     """
 
+    MATCH_WINDOW_DAYS = 0
+
     budget: Budget
 
     category_encoder: LabelEncoder
@@ -63,7 +70,7 @@ class Dataset:
         return self._load_dataset(transactions)
 
     # a day
-    @cache(60 * 60 * 24)
+    @cache(60 * 60 * 24, stale_while_revalidate=False)
     def _load_accounts(self, budget_id: str) -> List[Tuple[BunqAccount, YnabAccount]]:
         """
         Load Bunq-Ynab account tuples, by matching YnabAccount descriptions with
@@ -72,15 +79,13 @@ class Dataset:
         """
         result = []
         ynab_accounts = self.budget.accounts
-        bunq_accounts = get_bunq_connector().get_bunq_accounts()
+        bunq_accounts = get_bunq_connector().get_bunq_account_index()
         for y_account in ynab_accounts:
-            iban = y_account.iban
-            for b_account in bunq_accounts:
-                if b_account.iban == iban:
-                    y_account.load_transactions()
-                    b_account.load_transactions()
-                    result.append((b_account, y_account))
-                    break
+            b_account = bunq_accounts.get(normalize_iban(y_account.iban))
+            if b_account is not None:
+                y_account.load_transactions()
+                b_account.load_transactions()
+                result.append((b_account, y_account))
         return result
 
     def _load_transactions(
@@ -103,18 +108,13 @@ class Dataset:
         Load all transactions for both accounts. Match them on date and amount. Return
         list of matched tuples
         """
-        b_transactions = b_account.transactions
-        y_transactions = y_account.transactions
-        matched_transactions = []
-        for y_transaction in y_transactions:
-            if self._is_invalid_ynab_transaction(y_transaction):
-                continue
-            for b_transaction in b_transactions:
-                if self._transactions_match(y_transaction, b_transaction):
-                    b_transactions.remove(b_transaction)
-                    matched_transactions.append((b_transaction, y_transaction))
-                    break
-        return matched_transactions
+        y_transactions = [
+            t
+            for t in y_account.transactions
+            if not self._is_invalid_ynab_transaction(t)
+        ]
+        matcher = TransactionMatcher(self.MATCH_WINDOW_DAYS)
+        return matcher.match(b_account.transactions, y_transactions)
 
     def _load_dataset(
         self, transactions: List[Tuple[Payment, TransactionDetail]]
@@ -141,14 +141,6 @@ class Dataset:
         """
         return abs(transaction.amount / 1000) <= 0.05
 
-    @classmethod
-    def _transactions_match(cls, y: TransactionDetail, b: Payment) -> bool:
-        """
-        Match transactions on date and amount. Note that this might result in wrongly
-        matched items, but we don't mind this for now
-        """
-        return y.date == b.date and round(y.amount / 1000, 2) == float(b.amount.value)
-
     @property
     def is_valid(self):
         """
@@ -1,3 +1,9 @@
+import multiprocessing
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import joblib
 import mlflow
 from sklearn.ensemble import RandomForestClassifier, AdaBoostClassifier
 from sklearn.naive_bayes import GaussianNB
@@ -6,14 +12,18 @@ from sklearn.neural_network import MLPClassifier
 from sklearn.svm import SVC
 from sklearn.tree import DecisionTreeClassifier
 
+from helpers.helpers import get_config
 from model_selection.classifier import Classifier
 from model_selection.dataset import Dataset
 from model_selection.experiments.base_experiment import BaseExperiment
+from model_selection.feature_extractor import FeatureExtractor
 
 
 class ClassifierSelectionExperiment(BaseExperiment):
     """
-    An experiment to train and evaluate a list of classification algorithms
+    An experiment to train and evaluate a list of classification algorithms. The
+    classifiers are trained in parallel, on a pool of worker processes. The features
+    are extracted once, and shared with the workers as memory-mapped arrays
 
     ATTRIBUTES
     ----------
@@ -34,12 +44,43 @@ class ClassifierSelectionExperiment(BaseExperiment):
 
     @BaseExperiment.register_mlflow
     def run(self, dataset: Dataset):
+        """
+        - Extract the features once, and split them once, such that each classifier
+        is evaluated on the same sets
+        - Dump them to a temporary file, which the workers memory-map
+        - Train and evaluate each classifier in a worker, in a child run of the
+        experiment run
+        """
         mlflow.set_tag("budget", dataset.budget.id)
-        for clf in self.CLASSIFIERS:
-            try:
-                Classifier().train_evaluate(clf, dataset)
-            except Exception as e:
-                print(f"An Exception occurred: {e}")
+        feature_extractor, X, y = Classifier.extract_features(dataset)
+        train_idx, test_idx = Classifier.split_to_idx(X)
+        feature_names = feature_extractor.feature_names()
+        run = mlflow.active_run()
+        max_workers = get_config(
+            "selection_workers", min(len(self.CLASSIFIERS), os.cpu_count())
+        )
+        with tempfile.TemporaryDirectory() as directory:
+            path = f"{directory}/features.joblib"
+            joblib.dump((X, y, train_idx, test_idx, feature_names), path)
+            # Spawn, forked workers would inherit the active run of this process
+            context = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(max_workers, mp_context=context) as executor:
+                futures = [
+                    executor.submit(
+                        _train_evaluate_in_worker,
+                        clf,
+                        path,
+                        mlflow.get_tracking_uri(),
+                        run.info.experiment_id,
+                        run.info.run_id,
+                    )
+                    for clf in self.CLASSIFIERS
+                ]
+                for future in futures:
+                    try:
+                        future.result()
+                    except Exception as e:
+                        print(f"An Exception occurred: {e}")
         self.select_best_run()
 
     def select_best_run(self) -> None:
@@ -50,3 +91,26 @@ class ClassifierSelectionExperiment(BaseExperiment):
         best_run_row = runs.iloc[0]
         best_run_id = best_run_row["run_id"]
         self.best_run = mlflow.get_run(best_run_id)
+
+
+def _train_evaluate_in_worker(
+    clf, path: str, tracking_uri: str, experiment_id: str, parent_run_id: str
+):
+    """
+    Train and evaluate a classifier in a worker process, in a child run of the
+    experiment run. The features are memory-mapped from path
+    """
+    X, y, train_idx, test_idx, feature_names = joblib.load(path, mmap_mode="r")
+    if not FeatureExtractor.accepts_sparse(clf):
+        X = X.toarray()
+    mlflow.set_tracking_uri(tracking_uri)
+    mlflow.sklearn.autolog()
+    with mlflow.start_run(
+        experiment_id=experiment_id,
+        run_name=clf.__class__.__name__,
+        tags={"mlflow.parentRunId": parent_run_id},
+    ):
+        mlflow.log_text(",".join(feature_names), "features.txt")
+        Classifier().fit_evaluate(
+            clf, X[train_idx], X[test_idx], y[train_idx], y[test_idx]
+        )
@@ -2,28 +2,34 @@ from typing import Dict
 
 import mlflow
 from sklearn.base import BaseEstimator
-from sklearn.metrics import make_scorer
-from sklearn.model_selection import GridSearchCV
 
+from helpers.helpers import get_config
 from model_selection.classifier import Classifier
 from model_selection.dataset import Dataset
 from model_selection.experiments.base_experiment import BaseExperiment
+from model_selection.feature_extractor import FeatureExtractor
+from model_selection.parameter_search import ParameterSearch
 
 
 class HyperparameterTuningExperiment(BaseExperiment):
     """
-    An experiment to run hyperparam opt on a sklearn classifier
+    An experiment to run hyperparam opt on a sklearn classifier. The search is
+    configured by the 'tuning_search' (grid, randomized or halving), 'tuning_n_jobs',
+    'tuning_n_iter', 'tuning_cv' and 'tuning_time_budget' (seconds) config values.
+    See ParameterSearch
 
     ATTRIBUTES
     ----------
     clf: BaseEstimator
         The classifier to optimize
     space: Dict
-        The parameter space to run a gridsearch over
+        The parameter space to search
+    search: ParameterSearch
+        The search. Set in run()
     """
 
     clf: BaseEstimator
-    grid_search: GridSearchCV
+    search: ParameterSearch
     space: Dict
 
     def __init__(self, clf: BaseEstimator, space: Dict):
@@ -34,23 +40,38 @@ class HyperparameterTuningExperiment(BaseExperiment):
     @BaseExperiment.register_mlflow
     def run(self, dataset: Dataset):
         mlflow.set_tag("budget", dataset.budget.id)
-        score = make_scorer(self.score, greater_is_better=True)
-        grid_search = GridSearchCV(self.clf, self.space, scoring=score)
+        search = ParameterSearch(
+            self.clf,
+            self.space,
+            self.score,
+            mode=get_config("tuning_search", "grid"),
+            n_jobs=get_config("tuning_n_jobs", -1),
+            n_iter=get_config("tuning_n_iter", 20),
+            cv=get_config("tuning_cv", 5),
+            time_budget=get_config("tuning_time_budget", 0),
+        )
 
-        X_train, X_test, y_train, y_test = Classifier.split_to_sets(dataset)
+        X_train, X_test, y_train, y_test = Classifier.split_to_sets(
+            dataset, FeatureExtractor.accepts_sparse(self.clf)
+        )
 
-        grid_search.fit(X_train, y_train)
-        best_clf = grid_search.best_estimator_
+        search.fit(X_train, y_train)
+        mlflow.log_params(search.best_params_)
+        mlflow.log_param("search", search.mode)
+        mlflow.log_metric("cv_cohens_kappa", search.best_score_)
+        mlflow.log_metric("cached_folds", search.n_cached_folds)
+        mlflow.log_metric("evaluated_folds", search.n_evaluated_folds)
+        best_clf = search.best_estimator_
         y_pred = best_clf.predict(X_test)
         score = self.score(y_test, y_pred)
         print(f"Score of best clf: {score}")
         mlflow.log_metric("cohens_kappa", score)
         self.select_best_run()
-        self.grid_search = grid_search
+        self.search = search
 
     @classmethod
     def score(cls, y, y_pred):
-        return Classifier.evaluate(y, y_pred)[-1]
+        return Classifier.evaluate(y, y_pred, log=False)[-1]
 
     def select_best_run(self) -> None:
         self.best_run = mlflow.get_run(self.run_id)
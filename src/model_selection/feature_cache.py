@@ -0,0 +1,110 @@
+import hashlib
+import os
+import pickle
+import shutil
+from time import time
+from typing import List, Tuple, Union
+
+from bunq.sdk.model.generated.endpoint import Payment
+from numpy.typing import NDArray
+from scipy import sparse as sp
+
+from helpers.cache import CACHE_DIR
+from helpers.helpers import log
+from model_selection.feature_extractor import FeatureExtractor
+
+FEATURE_CACHE_DIR = f"{CACHE_DIR}/features"
+
+
+class FeatureCache:
+    """
+    Local cache of fitted FeatureExtractors and the feature matrices they produce.
+    Entries are keyed on a fingerprint of the payments and the configuration of the
+    extractor, hence all stages of a training run (classifier selection, tuning and
+    deployment) fit the extractor and transform the payments only once. Each entry is
+    a directory with the pickled extractor and the sparse matrix as .npz. Entries that
+    were not used for MAX_AGE_DAYS are removed
+
+    ATTRIBUTES
+    ----------
+    directory: str
+        The directory that contains the entries
+    """
+
+    MAX_AGE_DAYS = 30
+
+    directory: str
+
+    def __init__(self, directory: str = FEATURE_CACHE_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def get(
+        self, X: List[Payment], feature_extractor: FeatureExtractor
+    ) -> Tuple[FeatureExtractor, Union[sp.csr_matrix, NDArray]]:
+        """
+        Get the feature_extractor fitted on X, and X transformed. Load them from the
+        cache if possible, else fit and transform, and save them. The matrix is saved
+        sparse, the sparse attribute of the extractor decides what is returned
+        """
+        sparse = feature_extractor.sparse
+        path = f"{self.directory}/{self.key(X, feature_extractor)}"
+        if os.path.exists(path):
+            os.utime(path)
+            with open(f"{path}/feature_extractor.pickle", "rb") as file:
+                feature_extractor = pickle.load(file)
+            features = sp.load_npz(f"{path}/features.npz")
+            log("Loaded features from the feature cache")
+        else:
+            feature_extractor.sparse = True
+            features = feature_extractor.fit_transform(X)
+            self._save(path, feature_extractor, features)
+            self._prune()
+        feature_extractor.sparse = sparse
+        return feature_extractor, features if sparse else features.toarray()
+
+    @classmethod
+    def key(cls, X: List[Payment], feature_extractor: FeatureExtractor) -> str:
+        """
+        Fingerprint of the payment fields the extractor uses, and of its parameters.
+        The sparse parameter is excluded, it only decides the output format
+        """
+        params = feature_extractor.get_params()
+        params.pop("sparse", None)
+        digest = hashlib.sha256(
+            f"{feature_extractor.__class__.__name__}{sorted(params.items())}".encode()
+        )
+        for t in X:
+            digest.update(
+                f"{t.id_}|{t.amount.value}|{t.datetime.isoformat()}|"
+                f"{t.description}\n".encode()
+            )
+        return digest.hexdigest()
+
+    def _save(
+        self, path: str, feature_extractor: FeatureExtractor, features: sp.csr_matrix
+    ) -> None:
+        """
+        Save an entry. Write it to a temporary directory first, and move it in place
+        when it is complete, such that a concurrent reader never sees half an entry
+        """
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        os.makedirs(tmp_path, exist_ok=True)
+        with open(f"{tmp_path}/feature_extractor.pickle", "wb") as file:
+            pickle.dump(feature_extractor, file)
+        sp.save_npz(f"{tmp_path}/features.npz", features, compressed=False)
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            # Saved concurrently by another process
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+    def _prune(self) -> None:
+        """
+        Remove the entries that were not used for MAX_AGE_DAYS
+        """
+        threshold = time() - self.MAX_AGE_DAYS * 24 * 60 * 60
+        for name in os.listdir(self.directory):
+            path = f"{self.directory}/{name}"
+            if os.path.getmtime(path) < threshold:
+                shutil.rmtree(path, ignore_errors=True)
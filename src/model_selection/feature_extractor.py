@@ -1,10 +1,19 @@
-from typing import List
+from collections import Counter
+from datetime import datetime
+from typing import Dict, List, Tuple, Union
 
 import numpy as np
-import pandas as pd
 from bunq.sdk.model.generated.endpoint import Payment
+from numpy.typing import NDArray
+from scipy import sparse as sp
 from sklearn.base import TransformerMixin, BaseEstimator
-from sklearn.feature_extraction.text import TfidfVectorizer, CountVectorizer
+from sklearn.feature_extraction.text import (
+    TfidfVectorizer,
+    CountVectorizer,
+    HashingVectorizer,
+)
+
+from helpers.helpers import get_config
 
 
 class FeatureExtractor(BaseEstimator, TransformerMixin):
@@ -15,17 +24,91 @@ class FeatureExtractor(BaseEstimator, TransformerMixin):
     ----------
     description_encoder: CountVectorizer
         The encoder that encodes bunq-transaction 'Descriptions' into vectors, using BOW
+    sparse: bool
+        If True, transform() returns a scipy csr matrix. Else a dense array, for
+        estimators that do not accept sparse input (see DENSE_ONLY_ESTIMATORS).
+        Defaults to False on class level, for extractors pickled before this option
+        existed
+    description_encoding: str
+        How descriptions are encoded:
+        - tfidf: TFIDF over the words, the vocabulary is fit on the descriptions
+        - hashing: words and character n-grams are hashed into n_features columns.
+        Stateless, hence nothing has to be fit, the extractor has a constant size
+        regardless of the nr of distinct words, and payments can be transformed in
+        batches (out-of-core)
+        Can be set per budget with the 'description_encodings' config value, see
+        for_budget()
+    n_features: int
+        Nr of columns of the hashing encoding. Kept small by default, dense-only
+        estimators get a dense matrix of this width
     """
 
     description_encoder: CountVectorizer
+    sparse: bool = False
+    description_encoding: str = "tfidf"
+    n_features: int = 2**12
     COLUMNS = [
         "amount",
         "hour",
         "minute",
         "weekday",
     ]
+    # Estimators that cannot be fit on a sparse matrix
+    DENSE_ONLY_ESTIMATORS = ["GaussianNB"]
+
+    ENCODINGS = ["tfidf", "hashing"]
+    # Character n-gram sizes of the hashing encoding
+    CHAR_NGRAM_RANGE = (3, 5)
+
+    def __init__(
+        self,
+        sparse: bool = True,
+        description_encoding: str = "tfidf",
+        n_features: int = 2**12,
+    ):
+        if description_encoding not in self.ENCODINGS:
+            raise ValueError(
+                f"Unknown description encoding {description_encoding}, choose from "
+                f"{self.ENCODINGS}"
+            )
+        self.sparse = sparse
+        self.description_encoding = description_encoding
+        self.n_features = n_features
+
+    @classmethod
+    def for_budget(cls, budget_id: str, sparse: bool = True) -> "FeatureExtractor":
+        """
+        Create the extractor of a budget. Its description encoding is read from the
+        'description_encodings' config value, a dict of budget id -> encoding.
+        Budgets that are not in it use tfidf. The width of the hashing encoding is
+        read from 'hashing_n_features'
+        """
+        encodings = get_config("description_encodings", {})
+        n_features = get_config("hashing_n_features", cls.n_features)
+        return cls(sparse, encodings.get(budget_id, "tfidf"), n_features)
+
+    @property
+    def is_hashing(self) -> bool:
+        return self.description_encoding == "hashing"
+
+    @classmethod
+    def accepts_sparse(cls, clf) -> bool:
+        """
+        Whether an estimator can be fit on the sparse output of transform()
+        """
+        return clf.__class__.__name__ not in cls.DENSE_ONLY_ESTIMATORS
 
     def fit(self, X: List[Payment], y=None) -> "FeatureExtractor":
+        if self.is_hashing:
+            # Stateless, nothing to fit
+            self.description_encoder = HashingVectorizer(
+                analyzer=DescriptionAnalyzer(self.CHAR_NGRAM_RANGE),
+                n_features=self.n_features,
+                alternate_sign=False,
+                lowercase=False,
+                token_pattern=None,
+            )
+            return self
 
         # Fit TFIDF encoder
         descriptions = [t.description for t in X]
@@ -34,38 +117,137 @@ class FeatureExtractor(BaseEstimator, TransformerMixin):
         self.description_encoder = description_encoder
         return self
 
-    def transform(self, X: List[Payment], y=None) -> pd.DataFrame:
-        # Load all data
-        data = np.array(
-            [
-                [
-                    t.description,
-                    float(t.amount.value),
-                    int(t.datetime.hour),
-                    int(t.datetime.minute),
-                    int(t.datetime.weekday()),
-                ]
-                for t in X
-            ],
-            dtype="object",
-        )
-        # Convert descriptions into bag of words
-        descriptions = data[:, 0]
-        bag_of_words = np.array(
-            self.description_encoder.transform(descriptions).toarray()
+    def transform(self, X: List[Payment], y=None) -> Union[sp.csr_matrix, NDArray]:
+        """
+        Transform payments into a matrix of [*COLUMNS, *words]. The numeric columns
+        are extracted in one pass into a preallocated array, the descriptions are
+        encoded as sparse TFIDF vectors
+        """
+        numeric = np.empty((len(X), len(self.COLUMNS)), dtype=np.float64)
+        descriptions = []
+        for i, t in enumerate(X):
+            numeric[i] = (
+                float(t.amount.value),
+                t.datetime.hour,
+                t.datetime.minute,
+                t.datetime.weekday(),
+            )
+            descriptions.append(t.description)
+        return self._combine(numeric, descriptions)
+
+    def transform_raw_batch(
+        self, payments: List[Dict]
+    ) -> Union[sp.csr_matrix, NDArray]:
+        """
+        Transform a list of raw payment dicts (as received from bunq) in one
+        vectorized call. Returns the same matrix as transform() on the payments
+        """
+        numeric = np.empty((len(payments), len(self.COLUMNS)), dtype=np.float64)
+        descriptions = []
+        for i, payment in enumerate(payments):
+            created = datetime.fromisoformat(payment["created"])
+            numeric[i] = (
+                float(payment["amount"]["value"]),
+                created.hour,
+                created.minute,
+                created.weekday(),
+            )
+            descriptions.append(payment["description"])
+        return self._combine(numeric, descriptions)
+
+    def _combine(
+        self, numeric: NDArray, descriptions: List[str]
+    ) -> Union[sp.csr_matrix, NDArray]:
+        """
+        Encode the descriptions, and stack them after the numeric columns
+        """
+        bag_of_words = self._encode_descriptions(descriptions)
+        features = sp.hstack([sp.csr_matrix(numeric), bag_of_words], format="csr")
+        if self.sparse:
+            return features
+        return features.toarray()
+
+    def _encode_descriptions(self, descriptions: List[str]) -> sp.csr_matrix:
+        return self.description_encoder.transform(descriptions)
+
+    def transform_raw(self, payment: Dict) -> NDArray:
+        """
+        Low latency transform of a single payment, straight from the raw payment dict
+        (as received from bunq), without creating a Payment or running the vectorizer
+        pipeline. Returns the same values as transform([payment]), as a dense 1-row
+        array: every estimator accepts it, and predicting on it is faster than on a
+        1-row sparse matrix.
+        - Numeric columns are read from the dict, 'created' is parsed as iso format
+        - The description is tokenized by the analyzer of the encoder, and looked up in
+        its vocabulary. The counts are weighted with idf_ and normalized like the
+        TfidfVectorizer does
+        """
+        encoder = self.description_encoder
+        offset = len(self.COLUMNS)
+        if self.is_hashing:
+            row = np.zeros((1, offset + self.n_features), dtype=np.float64)
+        else:
+            row = np.zeros((1, offset + len(encoder.vocabulary_)), dtype=np.float64)
+
+        created = datetime.fromisoformat(payment["created"])
+        row[0, :offset] = (
+            float(payment["amount"]["value"]),
+            created.hour,
+            created.minute,
+            created.weekday(),
         )
-        # Merge into one array, and convert to frame
-        data = np.concatenate((data, bag_of_words), axis=1)
-        return pd.DataFrame(
-            data[:, 1:],
-            columns=[
-                *self.COLUMNS,
-                *[
-                    f"word_{w}"
-                    for w in self.description_encoder.get_feature_names_out()
-                ],
-            ],
+
+        if self.is_hashing:
+            bag_of_words = encoder.transform([payment["description"]])
+            row[0, bag_of_words.indices + offset] = bag_of_words.data
+            return row
+
+        counts = Counter(
+            encoder.vocabulary_[token]
+            for token in self._get_analyzer()(payment["description"])
+            if token in encoder.vocabulary_
         )
+        if not counts:
+            return row
+        word_idx = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+        tf = np.fromiter(counts.values(), dtype=np.float64, count=len(counts))
+        if encoder.sublinear_tf:
+            tf = np.log(tf) + 1
+        if encoder.use_idf:
+            tf *= encoder.idf_[word_idx]
+        if encoder.norm == "l2":
+            tf /= np.sqrt(np.dot(tf, tf))
+        elif encoder.norm == "l1":
+            tf /= np.abs(tf).sum()
+        row[0, word_idx + offset] = tf
+        return row
+
+    def _get_analyzer(self):
+        """
+        The analyzer (preprocessing + tokenization) of the description encoder. Built
+        once, not pickled
+        """
+        if getattr(self, "_analyzer", None) is None:
+            self._analyzer = self.description_encoder.build_analyzer()
+        return self._analyzer
+
+    def __getstate__(self):
+        # Copy, on python >= 3.11 the base class returns the __dict__ itself
+        state = dict(super().__getstate__())
+        state.pop("_analyzer", None)
+        return state
+
+    def get_feature_names_out(self, input_features=None) -> NDArray:
+        """
+        Get the name of each column in the output of transform()
+        """
+        if self.is_hashing:
+            words = [f"hash_{i}" for i in range(self.n_features)]
+        else:
+            words = [
+                f"word_{w}" for w in self.description_encoder.get_feature_names_out()
+            ]
+        return np.array([*self.COLUMNS, *words], dtype=object)
 
     def feature_names(self) -> List[str]:
         """
@@ -75,3 +257,28 @@ class FeatureExtractor(BaseEstimator, TransformerMixin):
             f"description ({self.description_encoder.__class__.__name__})",
             *self.COLUMNS,
         ]
+
+
+class DescriptionAnalyzer:
+    """
+    Analyzer of the hashing encoding: the word tokens of a description, and the
+    character n-grams within its words. Both are case-sensitive, like the words of
+    the tfidf encoding. A class instead of a closure, such that the
+    extractor can be pickled
+    """
+
+    def __init__(self, char_ngram_range: Tuple[int, int]):
+        self.char_ngram_range = char_ngram_range
+        self._words = CountVectorizer(lowercase=False).build_analyzer()
+        self._char_ngrams = CountVectorizer(
+            analyzer="char_wb", ngram_range=char_ngram_range, lowercase=False
+        ).build_analyzer()
+
+    def __call__(self, description: str) -> List[str]:
+        return self._words(description) + self._char_ngrams(description)
+
+    def __getstate__(self):
+        return {"char_ngram_range": self.char_ngram_range}
+
+    def __setstate__(self, state):
+        self.__init__(state["char_ngram_range"])
@@ -0,0 +1,90 @@
+import hashlib
+import json
+import sqlite3
+from contextlib import closing
+from typing import Dict, Iterable, Optional
+
+import numpy as np
+from scipy import sparse as sp
+
+from helpers.cache import CACHE_DIR
+
+FOLD_CACHE_FILE = f"{CACHE_DIR}/fold_scores.sqlite"
+
+
+def fingerprint(*arrays) -> str:
+    """
+    Fingerprint of the contents of numpy arrays and scipy sparse matrices
+    """
+    digest = hashlib.sha256()
+    for array in arrays:
+        if sp.issparse(array):
+            array = array.tocsr()
+            parts = [array.data, array.indices, array.indptr]
+        else:
+            parts = [np.asarray(array)]
+        digest.update(str(array.shape).encode())
+        for part in parts:
+            digest.update(np.ascontiguousarray(part).tobytes())
+    return digest.hexdigest()
+
+
+class FoldCache:
+    """
+    Local store of the score of a set of parameters on a single cv fold. Scores are
+    keyed on the fingerprint of the data, the estimator and its parameters, and the
+    fold. Hence a search on unchanged data skips the folds it evaluated before
+    """
+
+    path: str
+
+    def __init__(self, path: str = FOLD_CACHE_FILE):
+        self.path = path
+        with closing(self._connect()) as connection, connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS folds (key TEXT PRIMARY KEY, score REAL)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        # One connection per call, like the other stores
+        return sqlite3.connect(self.path, timeout=30)
+
+    @staticmethod
+    def key(data_fingerprint: str, estimator: str, params: Dict, fold: str) -> str:
+        """
+        The key of a fold. Params are serialized with sorted keys, values that are
+        not json serializable by their repr
+        """
+        key = [data_fingerprint, estimator, params, fold]
+        return hashlib.sha256(
+            json.dumps(key, sort_keys=True, default=repr).encode()
+        ).hexdigest()
+
+    def get_scores(self, keys: Iterable[str]) -> Dict[str, Optional[float]]:
+        """
+        Get the cached scores of the keys that are in the cache. A failed fold has
+        score None
+        """
+        keys = list(keys)
+        scores = {}
+        with closing(self._connect()) as connection:
+            # Chunk, sqlite limits the nr of variables per query
+            for i in range(0, len(keys), 500):
+                chunk = keys[i : i + 500]
+                rows = connection.execute(
+                    f"SELECT key, score FROM folds WHERE key IN "
+                    f"({','.join('?' * len(chunk))})",
+                    chunk,
+                ).fetchall()
+                scores.update(rows)
+        return scores
+
+    def add_scores(self, scores: Dict[str, Optional[float]]) -> None:
+        """
+        Save scores. A failed fold should have score None
+        """
+        with closing(self._connect()) as connection, connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO folds VALUES (?, ?)", scores.items()
+            )
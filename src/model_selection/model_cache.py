@@ -0,0 +1,182 @@
+import threading
+from collections import OrderedDict
+from time import monotonic
+from typing import Dict, List, Tuple
+
+from helpers.helpers import get_config, log, parallel_map
+from model_selection.budget_model import BudgetModel
+from model_selection.model_manifest import ModelManifest
+
+
+class ModelCache:
+    """
+    Keeps the models of the budgets in memory. Models are loaded on their first use,
+    at most MAX_RESIDENT_MODELS are kept in memory (least recently used models are
+    evicted). A model can be reloaded without affecting the others: the new model is
+    loaded and warmed up next to the old one, and swapped in with a single
+    assignment. Requests never wait for a reload, and if it fails the old model
+    stays in place.
+
+    Whenever the ModelManifest changes (a model was deployed), only the resident
+    models of which the version in the manifest differs are reloaded.
+
+    If a model cannot be loaded, the failure is remembered for FAILED_LOAD_TTL
+    seconds. Until then, or until the manifest changes, requests for that budget
+    fail right away, instead of querying the registry and downloading again.
+
+    ATTRIBUTES
+    ----------
+    max_resident_models: int
+        Max nr of models kept in memory. Defaults to the 'max_resident_models' config
+        value, or MAX_RESIDENT_MODELS
+    models: OrderedDict[str, BudgetModel]
+        The resident models, by budget id, in order of last use
+    manifest: ModelManifest
+        The manifest of the deployed models
+    """
+
+    MAX_RESIDENT_MODELS = 10
+    FAILED_LOAD_TTL = 60
+
+    max_resident_models: int
+    models: "OrderedDict[str, BudgetModel]"
+    manifest: ModelManifest
+
+    def __init__(
+        self, max_resident_models: int = None, manifest: ModelManifest = None
+    ):
+        self.max_resident_models = max_resident_models or get_config(
+            "max_resident_models", self.MAX_RESIDENT_MODELS
+        )
+        self.manifest = manifest or ModelManifest()
+        self.models = OrderedDict()
+        self._lock = threading.Lock()
+        # One lock per budget, such that a model is loaded only once at a time
+        self._load_locks: Dict[str, threading.Lock] = {}
+        # Version of the manifest the resident models were last checked against
+        self._manifest_version = self.manifest.version()
+        self._reloading = False
+        # Budget id -> (time, error) of the last failed load
+        self._failed_loads: Dict[str, Tuple[float, Exception]] = {}
+
+    def get_model(self, budget_id: str) -> BudgetModel:
+        """
+        Get the model of a budget, load it if it is not resident yet
+        """
+        with self._lock:
+            if budget_id in self.models:
+                self.models.move_to_end(budget_id)
+                return self.models[budget_id]
+            load_lock = self._load_locks.setdefault(budget_id, threading.Lock())
+        with load_lock:
+            with self._lock:
+                # Might have been loaded while we were waiting for the lock
+                if budget_id in self.models:
+                    return self.models[budget_id]
+                failed_load = self._failed_loads.get(budget_id)
+            if failed_load is not None:
+                failed_at, error = failed_load
+                if monotonic() - failed_at < self.FAILED_LOAD_TTL:
+                    raise Exception(
+                        f"Loading the model of budget {budget_id} failed "
+                        f"{monotonic() - failed_at:.0f}s ago: {error}"
+                    )
+            try:
+                return self.reload(budget_id)
+            except Exception as e:
+                with self._lock:
+                    self._failed_loads[budget_id] = (monotonic(), e)
+                raise e
+
+    def reload(self, budget_id: str, entry: Dict = None) -> BudgetModel:
+        """
+        Load the newest model of a budget (or the one of a ModelManifest entry), warm
+        it up, and swap it in. Requests that are being handled keep using the old
+        model. Other budgets are not affected
+        """
+        model = self._load_model(budget_id, entry)
+        model.warm()
+        with self._lock:
+            self.models[budget_id] = model
+            self.models.move_to_end(budget_id)
+            self._failed_loads.pop(budget_id, None)
+            while len(self.models) > self.max_resident_models:
+                evicted_id, _ = self.models.popitem(last=False)
+                log(f"Evicted model of budget {evicted_id}")
+        log(f"Loaded model of budget {budget_id}")
+        return model
+
+    def _load_model(self, budget_id: str, entry: Dict = None) -> BudgetModel:
+        return BudgetModel(budget_id).load(entry)
+
+    def reload_all(self) -> None:
+        """
+        Reload all resident models. Models that are not resident will be loaded in
+        their newest version on their next request anyway
+        """
+        with self._lock:
+            budget_ids = list(self.models.keys())
+        for budget_id in budget_ids:
+            try:
+                self.reload(budget_id)
+            except Exception as e:
+                log(f"Could not reload model of budget {budget_id}: {e}", True)
+
+    def reload_changed(self) -> List[str]:
+        """
+        Reload the resident models whose version differs from the version in the
+        ModelManifest. Return the ids of the reloaded budgets
+        """
+        entries = self.manifest.load()
+        with self._lock:
+            changed = [
+                (budget_id, entries[budget_id])
+                for budget_id, model in self.models.items()
+                if budget_id in entries
+                and entries[budget_id]["version"] != model.version
+            ]
+        reloaded = []
+        for budget_id, entry in changed:
+            try:
+                self.reload(budget_id, entry)
+                reloaded.append(budget_id)
+            except Exception as e:
+                log(f"Could not reload model of budget {budget_id}: {e}", True)
+        return reloaded
+
+    def reload_if_changed(self) -> None:
+        """
+        If the ModelManifest changed since the last check, reload the changed models
+        in a background thread. Cheap enough to call on every request
+        """
+        version = self.manifest.version()
+        with self._lock:
+            if version == self._manifest_version or self._reloading:
+                return
+            self._manifest_version = version
+            # Models might have been deployed for the budgets that failed to load
+            self._failed_loads.clear()
+            self._reloading = True
+        threading.Thread(target=self._reload_changed, daemon=True).start()
+
+    def _reload_changed(self) -> None:
+        try:
+            self.reload_changed()
+        finally:
+            with self._lock:
+                self._reloading = False
+
+    def preload(self) -> None:
+        """
+        Load the models of the budgets in the ModelManifest in parallel, at most
+        max_resident_models. No datasets are built and the registry is not queried,
+        hence this takes only as long as loading the models
+        """
+        budget_ids = list(self.manifest.load().keys())[: self.max_resident_models]
+        parallel_map(self._preload, budget_ids)
+
+    def _preload(self, budget_id: str) -> None:
+        try:
+            self.get_model(budget_id)
+        except Exception as e:
+            log(f"Could not load model of budget {budget_id}: {e}", True)
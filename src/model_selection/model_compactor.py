@@ -0,0 +1,176 @@
+import pickle
+from typing import List, Optional, Tuple
+
+import numpy as np
+from bunq.sdk.model.generated.endpoint import Payment
+from numpy.typing import NDArray
+from sklearn.base import ClassifierMixin, clone
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.metrics import accuracy_score
+
+from helpers.helpers import log
+from model_selection.compact_feature_extractor import CompactFeatureExtractor
+from model_selection.feature_extractor import FeatureExtractor
+
+
+class ModelCompactor:
+    """
+    Creates a compact inference artifact of a trained model, to reduce the memory
+    and load time per served budget:
+    - A tfidf feature extractor is converted into a CompactFeatureExtractor, if that
+    is smaller
+    - The float64 parameters of estimators in FLOAT32_ATTRIBUTES are cast to float32
+    - Random forests are pruned to the smallest prefix of their trees (halving the
+    nr of trees each step) that stays within MAX_ACCURACY_DELTA
+
+    A model that is evaluated on its own training data is accurate at any size (eg
+    a forest of a few trees), hence the compaction is selected on an evaluation
+    model: the same estimator, trained without the holdout payments. The compact
+    model is only used if the compacted evaluation model is at most
+    MAX_ACCURACY_DELTA less accurate on the holdout payments than the evaluation
+    model. The selected compaction is then applied to the deployed model
+
+    ATTRIBUTES
+    ----------
+    X: List[Payment]
+        The holdout payments to check the accuracy on
+    y: NDArray
+        Their labels
+    accuracy_delta: float
+        Accuracy of the evaluation model minus accuracy of the compacted evaluation
+        model. Set in compact()
+    """
+
+    MAX_ACCURACY_DELTA = 0.005
+    # Forests are not pruned below this nr of trees
+    MIN_TREES = 50
+    FLOAT32_ATTRIBUTES = {
+        "MLPClassifier": ["coefs_", "intercepts_"],
+        "GaussianNB": ["theta_", "var_"],
+    }
+
+    X: List[Payment]
+    y: NDArray
+    accuracy_delta: float
+
+    def __init__(self, X: List[Payment], y: NDArray):
+        self.X = X
+        self.y = y
+
+    def compact(
+        self,
+        feature_extractor: FeatureExtractor,
+        clf: ClassifierMixin,
+        evaluation_feature_extractor: FeatureExtractor,
+        evaluation_clf: ClassifierMixin,
+    ) -> Tuple[FeatureExtractor, ClassifierMixin]:
+        """
+        Select the compaction on the evaluation model (trained without the holdout
+        payments), and apply it to the feature extractor and estimator. If the
+        compact evaluation model is not accurate enough, return the full ones
+        """
+        full_accuracy = self._accuracy(evaluation_feature_extractor, evaluation_clf)
+        compact_evaluation_extractor = self._compact_extractor(
+            evaluation_feature_extractor
+        )
+        compact_evaluation_clf = self._cast_to_float32(evaluation_clf)
+        n_trees = self._select_nr_of_trees(
+            compact_evaluation_extractor, compact_evaluation_clf, full_accuracy
+        )
+        compact_evaluation_clf = self._forest_prefix(compact_evaluation_clf, n_trees)
+        self.accuracy_delta = full_accuracy - self._accuracy(
+            compact_evaluation_extractor, compact_evaluation_clf
+        )
+        if self.accuracy_delta > self.MAX_ACCURACY_DELTA:
+            log("The compact model is not accurate enough, using the full model", True)
+            return feature_extractor, clf
+
+        compact_extractor = self._compact_extractor(feature_extractor)
+        compact_clf = self._forest_prefix(self._cast_to_float32(clf), n_trees)
+        log(
+            f"Compact model: {self.size(compact_extractor, compact_clf)} bytes instead "
+            f"of {self.size(feature_extractor, clf)}, accuracy delta on the holdout "
+            f"payments {self.accuracy_delta:.4f}"
+        )
+        return compact_extractor, compact_clf
+
+    @staticmethod
+    def size(*objects) -> int:
+        """
+        The nr of bytes of the pickled objects
+        """
+        return sum(len(pickle.dumps(obj)) for obj in objects)
+
+    def _accuracy(
+        self, feature_extractor: FeatureExtractor, clf: ClassifierMixin
+    ) -> float:
+        return accuracy_score(self.y, clf.predict(feature_extractor.transform(self.X)))
+
+    def _cast_to_float32(self, clf: ClassifierMixin) -> ClassifierMixin:
+        attributes = self.FLOAT32_ATTRIBUTES.get(clf.__class__.__name__, [])
+        if not attributes:
+            return clf
+        compact_clf = pickle.loads(pickle.dumps(clf))
+        for attribute in attributes:
+            value = getattr(compact_clf, attribute)
+            if isinstance(value, list):
+                value = [v.astype(np.float32) for v in value]
+            else:
+                value = value.astype(np.float32)
+            setattr(compact_clf, attribute, value)
+        return compact_clf
+
+    def _compact_extractor(
+        self, feature_extractor: FeatureExtractor
+    ) -> FeatureExtractor:
+        """
+        The CompactFeatureExtractor of a feature extractor, or the extractor itself if
+        it is a hashing extractor (it has no vocabulary), or if the compact one is not
+        smaller (eg a vocabulary of a few terms)
+        """
+        if feature_extractor.is_hashing:
+            return feature_extractor
+        compact_extractor = CompactFeatureExtractor.from_feature_extractor(
+            feature_extractor
+        )
+        if self.size(compact_extractor) >= self.size(feature_extractor):
+            return feature_extractor
+        return compact_extractor
+
+    def _select_nr_of_trees(
+        self,
+        feature_extractor: FeatureExtractor,
+        clf: ClassifierMixin,
+        full_accuracy: float,
+    ) -> Optional[int]:
+        """
+        Select the smallest prefix of the trees of a random forest that is accurate
+        enough on the holdout payments. The trees are independent, hence a prefix is
+        a smaller forest. None if clf is not a random forest
+        """
+        if not isinstance(clf, RandomForestClassifier):
+            return None
+        n_trees = len(clf.estimators_)
+        X = feature_extractor.transform(self.X)
+        while n_trees // 2 >= self.MIN_TREES:
+            pruned = self._forest_prefix(clf, n_trees // 2)
+            accuracy = accuracy_score(self.y, pruned.predict(X))
+            if full_accuracy - accuracy > self.MAX_ACCURACY_DELTA:
+                break
+            n_trees //= 2
+        return n_trees
+
+    @staticmethod
+    def _forest_prefix(clf: ClassifierMixin, n_trees: Optional[int]) -> ClassifierMixin:
+        """
+        The random forest of the first n_trees trees of clf. clf itself if n_trees
+        is None
+        """
+        if n_trees is None:
+            return clf
+        pruned = clone(clf).set_params(n_estimators=n_trees)
+        for attribute, value in vars(clf).items():
+            if attribute.endswith("_") and not attribute.startswith("__"):
+                setattr(pruned, attribute, value)
+        pruned.estimators_ = clf.estimators_[:n_trees]
+        return pruned
@@ -1,14 +1,20 @@
 from datetime import datetime
-from typing import Dict, Any
+from typing import Dict, Any, Tuple
 
 import mlflow
 import numpy as np
 from mlflow.models import infer_signature
 from mlflow.tracking import MlflowClient
+from scipy import sparse as sp
+from sklearn.base import clone
 
-from helpers.helpers import object_to_mlflow, log, get_mlflow_model_name
+from helpers.helpers import object_to_mlflow, log, get_mlflow_model_name, get_config
+from model_selection.classifier import Classifier
 from model_selection.dataset import Dataset
+from model_selection.feature_cache import FeatureCache
 from model_selection.feature_extractor import FeatureExtractor
+from model_selection.model_compactor import ModelCompactor
+from model_selection.model_manifest import ModelManifest
 
 
 from sklearn.ensemble import RandomForestClassifier, AdaBoostClassifier
@@ -36,7 +42,8 @@ class ModelDeployer:
         """
         After the best classifier and its best params have been selected, create a new
         instance of the classifier with the best params, train it on the full dataset,
-        log it to mlflow
+        log it to mlflow. Unless the 'compact_models' config value is false, log the
+        compact inference artifact of the model instead, see _compact()
         """
 
         mlflow.set_experiment("Full training")
@@ -45,17 +52,32 @@ class ModelDeployer:
             mlflow.set_tag("budget", self.dataset.budget.id)
             classifier = eval(cls_name)(**hyperparameters)
 
-            X, y = np.array(self.dataset.X), np.array(self.dataset.y, int)
-            # Create feature extractor and transform X. Log extractor as object
-            feature_extractor = FeatureExtractor()
-            X = feature_extractor.fit_transform(X, y)
-            object_to_mlflow(feature_extractor, "feature_extractor")
+            y = np.array(self.dataset.y, int)
+            # Create feature extractor and transform X, or load both from the cache.
+            # Log extractor as object
+            feature_extractor, X = FeatureCache().get(
+                self.dataset.X,
+                FeatureExtractor.for_budget(
+                    self.dataset.budget.id, FeatureExtractor.accepts_sparse(classifier)
+                ),
+            )
             # Log label transformer to mlflow as well
             object_to_mlflow(self.dataset.category_encoder, "category_encoder")
-            # Fit and log
+            # Fit
             classifier.fit(X, y)
+            # Export the compact inference artifact, log it
+            if get_config("compact_models", True):
+                feature_extractor, classifier = self._compact(
+                    feature_extractor, classifier, y
+                )
+            mlflow.log_metric(
+                "model_bytes", ModelCompactor.size(feature_extractor, classifier)
+            )
+            object_to_mlflow(feature_extractor, "feature_extractor")
 
-            signature = infer_signature(X, y)
+            # Infer the schema on a dense sample, X may be sparse
+            sample = X[:10].toarray() if sp.issparse(X) else X[:10]
+            signature = infer_signature(sample, y[:10])
 
             path = "model"
             model_name = self._get_model_name()
@@ -66,12 +88,40 @@ class ModelDeployer:
                 signature=signature,
             )
 
+    def _compact(
+        self, feature_extractor: FeatureExtractor, classifier, y: np.ndarray
+    ) -> Tuple[FeatureExtractor, Any]:
+        """
+        Compact the fully trained model, see ModelCompactor. The compaction is
+        selected on an evaluation model: a clone of the classifier with its own
+        feature extractor, trained on the train split of the Classifier. Its
+        accuracy is checked on the test split
+        """
+        train_idx, test_idx = Classifier.split_to_idx(self.dataset.X)
+        evaluation_feature_extractor, X_train = FeatureCache().get(
+            self.dataset.X[train_idx],
+            FeatureExtractor.for_budget(
+                self.dataset.budget.id, feature_extractor.sparse
+            ),
+        )
+        evaluation_classifier = clone(classifier).fit(X_train, y[train_idx])
+        compactor = ModelCompactor(self.dataset.X[test_idx], y[test_idx])
+        feature_extractor, classifier = compactor.compact(
+            feature_extractor,
+            classifier,
+            evaluation_feature_extractor,
+            evaluation_classifier,
+        )
+        mlflow.log_metric("compact_accuracy_delta", compactor.accuracy_delta)
+        return feature_extractor, classifier
+
     def _bring_model_into_production(self):
         """
         Bringing the model into production means:
         - Call transition_model_version_stage with the version just created. Retrieve
         the version number by getting the latest version
         - Update model description
+        - Save it in the ModelManifest
         """
         client = MlflowClient()
         model_name = self._get_model_name()
@@ -89,6 +139,9 @@ class ModelDeployer:
             description=f"This model has been trained on {date}, on {set_size} "
             f"transactions",
         )
+        # Register it in the manifest, the model servers load it from there
+        model_version = client.get_model_version(model_name, version)
+        ModelManifest().set(self.dataset.budget.id, ModelManifest.entry(model_version))
 
     def _get_model_name(self):
         return get_mlflow_model_name(self.dataset)
@@ -0,0 +1,85 @@
+import json
+import os
+import threading
+from typing import Dict, Optional, Tuple
+
+from mlflow.entities.model_registry import ModelVersion
+
+from _setup.load_config import CONFIG_DIR
+
+MODEL_MANIFEST_FILE = f"{CONFIG_DIR}/model_manifest.json"
+
+
+class ModelManifest:
+    """
+    Manifest of the models in production, saved as json. Written by the
+    ModelDeployer, read by the model servers, such that they can load the models
+    without building datasets or querying the model registry. Per budget id, it
+    holds an entry with:
+    - name: the registered model name
+    - version: the registered model version
+    - run_id: the run that logged the model and its artifacts
+    - model_uri: the uri of the sklearn model of that version
+    - artifacts: the paths of the category_encoder and feature_extractor artifacts
+    in the run
+    """
+
+    ARTIFACTS = ["category_encoder", "feature_extractor"]
+    _lock = threading.Lock()
+
+    path: str
+
+    def __init__(self, path: str = MODEL_MANIFEST_FILE):
+        self.path = path
+
+    def load(self) -> Dict[str, Dict]:
+        """
+        Load all entries, by budget id. Empty if no model was deployed yet
+        """
+        try:
+            with open(self.path, "r") as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return {}
+
+    def version(self) -> Optional[Tuple[int, int]]:
+        """
+        The (mtime, size) of the manifest file, changes whenever an entry is set.
+        None if it does not exist
+        """
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def get(self, budget_id: str) -> Optional[Dict]:
+        return self.load().get(budget_id)
+
+    def set(self, budget_id: str, entry: Dict) -> None:
+        """
+        Save the entry of a budget. The file is replaced atomically, readers never
+        see a partially written manifest
+        """
+        with self._lock:
+            entries = self.load()
+            entries[budget_id] = entry
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as file:
+                json.dump(entries, file, indent=2)
+            os.replace(tmp_path, self.path)
+
+    @classmethod
+    def entry(cls, model_version: ModelVersion) -> Dict:
+        """
+        Create the entry of a registered model version
+        """
+        return {
+            "name": model_version.name,
+            "version": str(model_version.version),
+            "run_id": model_version.run_id,
+            "model_uri": model_version.source,
+            "artifacts": {
+                name: f"{name}/artifact.pickle" for name in cls.ARTIFACTS
+            },
+        }
@@ -105,5 +105,5 @@ class ModelSelector:
 
         experiment = HyperparameterTuningExperiment(eval(cls_name)(), hyper_space)
         experiment.run(self.dataset)
-        params = experiment.grid_search.best_params_
+        params = experiment.search.best_params_
         return params
\ No newline at end of file
@@ -0,0 +1,238 @@
+import math
+import warnings
+from time import monotonic
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from joblib import Parallel, delayed, effective_n_jobs
+from numpy.typing import NDArray
+from sklearn.base import BaseEstimator, clone
+from sklearn.model_selection import ParameterGrid, ParameterSampler, check_cv
+
+from helpers.helpers import log
+from model_selection.fold_cache import FoldCache, fingerprint
+
+
+class ParameterSearch:
+    """
+    Cross validated search for the best parameters of an estimator. Like the sklearn
+    searches, but each (parameters, fold) score is cached in a FoldCache, and the
+    search stops when the time budget is used. Modes:
+    - grid: evaluate all combinations of the space
+    - randomized: evaluate n_iter combinations sampled from the space
+    - halving: successive halving over all combinations. Each round evaluates the
+    remaining candidates on a factor times larger subsample of the data, and keeps
+    the best 1 / factor of them. The last round uses all data
+
+    ATTRIBUTES
+    ----------
+    estimator: BaseEstimator
+        The estimator to tune
+    space: Dict
+        The parameter space
+    score: Callable
+        score(y, y_pred), higher is better
+    mode: str
+        grid, randomized or halving
+    n_jobs: int
+        Nr of parallel jobs, -1 for all cores
+    n_iter: int
+        Nr of sampled combinations in randomized mode
+    cv: int
+        Nr of folds
+    time_budget: float
+        Seconds after which no new folds are started. 0 for no limit
+    best_params_: Dict
+        The best parameters. Set in fit()
+    best_score_: float
+        The mean cv score of the best parameters. Set in fit()
+    best_estimator_: BaseEstimator
+        The estimator with the best parameters, fit on all data. Set in fit()
+    """
+
+    MODES = ["grid", "randomized", "halving"]
+    HALVING_FACTOR = 3
+    RANDOM_STATE = 0
+
+    estimator: BaseEstimator
+    space: Dict
+    score: Callable
+    mode: str
+    n_jobs: int
+    n_iter: int
+    cv: int
+    time_budget: float
+    best_params_: Dict
+    best_score_: float
+    best_estimator_: BaseEstimator
+
+    def __init__(
+        self,
+        estimator: BaseEstimator,
+        space: Dict,
+        score: Callable,
+        mode: str = "grid",
+        n_jobs: int = -1,
+        n_iter: int = 20,
+        cv: int = 5,
+        time_budget: float = 0,
+        fold_cache: FoldCache = None,
+    ):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown search mode {mode}, choose from {self.MODES}")
+        self.estimator = estimator
+        self.space = space
+        self.score = score
+        self.mode = mode
+        self.n_jobs = n_jobs
+        self.n_iter = n_iter
+        self.cv = cv
+        self.time_budget = time_budget
+        self.fold_cache = fold_cache or FoldCache()
+        self.n_cached_folds = 0
+        self.n_evaluated_folds = 0
+        self._deadline = None
+
+    def fit(self, X: NDArray, y: NDArray) -> "ParameterSearch":
+        """
+        Search the best parameters on X, y. Then fit the estimator with them on X, y
+        """
+        self._deadline = monotonic() + self.time_budget if self.time_budget else None
+        candidates = self._get_candidates()
+        # Fixed permutation, such that subsamples are the same in each run
+        order = np.random.RandomState(self.RANDOM_STATE).permutation(len(y))
+        with Parallel(n_jobs=self.n_jobs) as parallel:
+            if self.mode == "halving":
+                scores = self._successive_halving(parallel, candidates, X, y, order)
+            else:
+                scores = self._evaluate(parallel, candidates, X, y, order)
+        if np.all(np.isnan(scores[1])):
+            raise Exception("No parameters could be evaluated")
+        best = int(np.nanargmax(scores[1]))
+        self.best_params_ = scores[0][best]
+        self.best_score_ = float(scores[1][best])
+        log(
+            f"Evaluated {self.n_evaluated_folds} folds, {self.n_cached_folds} were "
+            f"cached. Best score {self.best_score_:.3f}"
+        )
+        self.best_estimator_ = clone(self.estimator).set_params(**self.best_params_)
+        self.best_estimator_.fit(X, y)
+        return self
+
+    def _get_candidates(self) -> List[Dict]:
+        if self.mode == "randomized":
+            grid_size = len(ParameterGrid(self.space))
+            return list(
+                ParameterSampler(
+                    self.space,
+                    min(self.n_iter, grid_size),
+                    random_state=self.RANDOM_STATE,
+                )
+            )
+        return list(ParameterGrid(self.space))
+
+    def _successive_halving(
+        self, parallel: Parallel, candidates: List[Dict], X, y, order: NDArray
+    ) -> Tuple[List[Dict], NDArray]:
+        """
+        Run the rounds of successive halving. Returns the candidates and scores of the
+        last round that was evaluated completely
+        """
+        factor = self.HALVING_FACTOR
+        n_rounds = max(1, math.ceil(math.log(len(candidates), factor)))
+        # Each fold needs a few samples of each class
+        min_samples = min(len(y), self.cv * 10)
+        result = None
+        for round_nr in range(n_rounds):
+            n_samples = len(y) // factor ** (n_rounds - 1 - round_nr)
+            n_samples = max(min_samples, n_samples)
+            candidates, scores = self._evaluate(
+                parallel, candidates, X, y, order[:n_samples]
+            )
+            if np.all(np.isnan(scores)) and result is not None:
+                # Out of time
+                break
+            result = (candidates, scores)
+            keep = math.ceil(len(candidates) / factor)
+            # Nan scores are sorted last
+            best = np.argsort(-np.nan_to_num(scores, nan=-np.inf))[:keep]
+            candidates = [candidates[i] for i in best]
+        return result
+
+    def _evaluate(
+        self, parallel: Parallel, candidates: List[Dict], X, y, samples: NDArray
+    ) -> Tuple[List[Dict], NDArray]:
+        """
+        Get the mean cv score of each candidate on the samples. Cached folds are not
+        evaluated again. Candidates with a fold that failed or was not evaluated in
+        time get score nan
+        """
+        X, y = X[samples], y[samples]
+        folds = list(check_cv(self.cv, y, classifier=True).split(X, y))
+        data = fingerprint(X, y)
+        estimator = repr(self.estimator)
+        keys = [
+            [
+                self.fold_cache.key(data, estimator, params, f"{i}/{self.cv}")
+                for i in range(len(folds))
+            ]
+            for params in candidates
+        ]
+        scores = self.fold_cache.get_scores([k for ks in keys for k in ks])
+        self.n_cached_folds += len(scores)
+        todo = [
+            (key, params, fold)
+            for ks, params in zip(keys, candidates)
+            for key, fold in zip(ks, folds)
+            if key not in scores
+        ]
+        # Evaluate in chunks of complete candidates, such that we can stop when the
+        # time budget is used. The first chunk is always evaluated, to have a result
+        chunk_size = effective_n_jobs(self.n_jobs) * len(folds)
+        for i in range(0, len(todo), chunk_size):
+            has_result = i > 0 or self.n_evaluated_folds or len(scores)
+            if has_result and self._deadline and monotonic() > self._deadline:
+                log(f"Time budget used, skipping {len(todo) - i} folds")
+                break
+            chunk = todo[i : i + chunk_size]
+            results = parallel(
+                delayed(_fit_and_score)(self.estimator, params, X, y, fold, self.score)
+                for _, params, fold in chunk
+            )
+            new_scores = {key: score for (key, _, _), score in zip(chunk, results)}
+            self.fold_cache.add_scores(new_scores)
+            self.n_evaluated_folds += len(chunk)
+            scores.update(new_scores)
+
+        means = np.array(
+            [np.mean([_to_float(scores.get(key)) for key in ks]) for ks in keys]
+        )
+        return candidates, means
+
+
+def _to_float(score: Optional[float]) -> float:
+    return np.nan if score is None else score
+
+
+def _fit_and_score(
+    estimator: BaseEstimator,
+    params: Dict,
+    X,
+    y: NDArray,
+    fold: Tuple[NDArray, NDArray],
+    score: Callable,
+) -> Optional[float]:
+    """
+    Fit a clone of the estimator with params on the train part of the fold, score it
+    on the test part. None if it fails (eg invalid params), like the error_score of
+    the sklearn searches
+    """
+    train_idx, test_idx = fold
+    try:
+        clf = clone(estimator).set_params(**params)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            clf.fit(X[train_idx], y[train_idx])
+        return float(score(y[test_idx], clf.predict(X[test_idx])))
+    except Exception:
+        return None
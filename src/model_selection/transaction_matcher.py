@@ -0,0 +1,78 @@
+from collections import defaultdict, deque
+from datetime import date, timedelta
+from typing import Deque, Dict, List, Tuple
+
+from bunq.sdk.model.generated.endpoint import Payment
+from ynab import TransactionDetail
+
+
+class TransactionMatcher:
+    """
+    Matches ynab transactions with bunq payments on date and amount, in O(n + m).
+
+    Bunq payments are bucketed by (date, amount in cents). Each bucket is a queue in
+    the original order of the payments, hence each ynab transaction is matched with
+    the first unmatched payment on the same date with the same amount. Each payment
+    is matched at most once.
+
+    ATTRIBUTES
+    ----------
+    window_days: int
+        If > 0, a ynab transaction that has no payment on the same date is matched
+        with a payment at most window_days days earlier or later. Closer dates are
+        preferred, earlier dates win ties. Useful if the value date drifted
+    """
+
+    window_days: int
+
+    def __init__(self, window_days: int = 0):
+        self.window_days = window_days
+
+    def match(
+        self, b_transactions: List[Payment], y_transactions: List[TransactionDetail]
+    ) -> List[Tuple[Payment, TransactionDetail]]:
+        """
+        Match the ynab transactions with the bunq payments, in order of the ynab
+        transactions. Return list of matched tuples
+        """
+        buckets = self._bucket(b_transactions)
+        offsets = self._day_offsets()
+        matched_transactions = []
+        for y_transaction in y_transactions:
+            cents = self.ynab_cents(y_transaction)
+            for offset in offsets:
+                bucket = buckets.get((y_transaction.date + offset, cents))
+                if bucket:
+                    matched_transactions.append((bucket.popleft(), y_transaction))
+                    break
+        return matched_transactions
+
+    def _bucket(
+        self, b_transactions: List[Payment]
+    ) -> Dict[Tuple[date, int], Deque[Payment]]:
+        buckets = defaultdict(deque)
+        for b_transaction in b_transactions:
+            buckets[(b_transaction.date, self.bunq_cents(b_transaction))].append(
+                b_transaction
+            )
+        return buckets
+
+    def _day_offsets(self) -> List[timedelta]:
+        """
+        The date offsets to try, in order of preference: 0, -1, 1, -2, 2, ...
+        """
+        offsets = [timedelta(0)]
+        for days in range(1, self.window_days + 1):
+            offsets.extend([timedelta(days=-days), timedelta(days=days)])
+        return offsets
+
+    @staticmethod
+    def ynab_cents(transaction: TransactionDetail) -> int:
+        """
+        Ynab amounts are in milli units
+        """
+        return round(transaction.amount / 10)
+
+    @staticmethod
+    def bunq_cents(payment: Payment) -> int:
+        return round(float(payment.amount.value) * 100)
@@ -0,0 +1,85 @@
+if __name__ == "__main__":
+    import _fix_imports
+import pickle
+import random
+import tracemalloc
+from datetime import datetime, timedelta
+from time import perf_counter
+from types import SimpleNamespace
+from typing import List, Tuple
+
+from sklearn.metrics import cohen_kappa_score
+from sklearn.svm import LinearSVC
+
+from model_selection.feature_extractor import FeatureExtractor
+
+TRAIN_SIZE = 8000
+TEST_SIZE = 2000
+NR_CATEGORIES = 20
+VOCABULARY_SIZES = [1000, 10000, 50000]
+
+
+def labeled_payments(
+    size: int, vocabulary_size: int, seed: int = 0
+) -> Tuple[List, List[int]]:
+    """
+    Create size payments with a label. Each word belongs to a random category, the
+    label of a payment is the category of its first word. The other words are noise
+    """
+    rng = random.Random(seed)
+    categories = random.Random(vocabulary_size).choices(
+        range(NR_CATEGORIES), k=vocabulary_size
+    )
+    start = datetime(2022, 1, 1)
+    payments, labels = [], []
+    for _ in range(size):
+        words = rng.choices(range(vocabulary_size), k=rng.randint(1, 6))
+        payments.append(
+            SimpleNamespace(
+                description=" ".join(f"shop{word}" for word in words),
+                amount=SimpleNamespace(value=f"{rng.randint(-20000, 20000) / 100:.2f}"),
+                datetime=start + timedelta(minutes=rng.randint(0, 365 * 24 * 60)),
+            )
+        )
+        labels.append(categories[words[0]])
+    return payments, labels
+
+
+def benchmark_encoding(encoding: str, vocabulary_size: int) -> str:
+    X, y = labeled_payments(TRAIN_SIZE + TEST_SIZE, vocabulary_size)
+    X_train, X_test = X[:TRAIN_SIZE], X[TRAIN_SIZE:]
+    y_train, y_test = y[:TRAIN_SIZE], y[TRAIN_SIZE:]
+
+    feature_extractor = FeatureExtractor(description_encoding=encoding)
+    start = perf_counter()
+    features = feature_extractor.fit_transform(X_train)
+    fit_time = perf_counter() - start
+    # Measure memory in a separate fit, tracemalloc slows down allocations
+    tracemalloc.start()
+    FeatureExtractor(description_encoding=encoding).fit_transform(X_train)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    clf = LinearSVC().fit(features, y_train)
+    kappa = cohen_kappa_score(y_test, clf.predict(feature_extractor.transform(X_test)))
+    size = len(pickle.dumps(feature_extractor))
+    return (
+        f"{encoding:<8} vocabulary {vocabulary_size:>6}: fit {fit_time:.3f}s, "
+        f"peak memory {peak / 2**20:.1f}MiB, extractor {size / 2**10:.1f}KiB, "
+        f"kappa {kappa:.3f}"
+    )
+
+
+def benchmark():
+    """
+    Compare the tfidf and hashing description encodings on synthetic payments, for a
+    growing vocabulary: the time and peak memory of fitting the extractor, the size
+    of the pickled extractor, and the cohen kappa of a classifier on a holdout set
+    """
+    for vocabulary_size in VOCABULARY_SIZES:
+        for encoding in FeatureExtractor.ENCODINGS:
+            print(benchmark_encoding(encoding, vocabulary_size))
+
+
+if __name__ == "__main__":
+    benchmark()
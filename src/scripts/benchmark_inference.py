@@ -0,0 +1,79 @@
+if __name__ == "__main__":
+    import _fix_imports
+import random
+from datetime import datetime, timedelta
+from time import perf_counter
+from types import SimpleNamespace
+from typing import Dict, List, Tuple
+
+import numpy as np
+from sklearn.tree import DecisionTreeClassifier
+
+from model_selection.feature_extractor import FeatureExtractor
+
+TRAIN_SIZE = 5000
+NR_PREDICTIONS = 2000
+WORDS = [f"word{i}" for i in range(2000)]
+
+
+def synthetic_payments(size: int, seed: int = 0) -> Tuple[List, List[Dict]]:
+    """
+    Create size payments, both as Payment-like objects and as raw payment dicts
+    """
+    rng = random.Random(seed)
+    start = datetime(2022, 1, 1)
+    payments, raw_payments = [], []
+    for _ in range(size):
+        created = start + timedelta(seconds=rng.randint(0, 365 * 24 * 60 * 60))
+        description = " ".join(rng.choices(WORDS, k=rng.randint(1, 8)))
+        value = f"{rng.randint(-20000, 20000) / 100:.2f}"
+        payments.append(
+            SimpleNamespace(
+                description=description,
+                amount=SimpleNamespace(value=value),
+                datetime=created,
+            )
+        )
+        raw_payments.append(
+            {
+                "description": description,
+                "amount": {"value": value, "currency": "EUR"},
+                "created": created.strftime("%Y-%m-%d %H:%M:%S.%f"),
+            }
+        )
+    return payments, raw_payments
+
+
+def percentiles(timings: List[float]) -> str:
+    p50, p99 = np.percentile(np.array(timings) * 1000, [50, 99])
+    return f"p50 {p50:.3f}ms, p99 {p99:.3f}ms"
+
+
+def benchmark():
+    payments, _ = synthetic_payments(TRAIN_SIZE)
+    y = [random.randint(0, 20) for _ in payments]
+    feature_extractor = FeatureExtractor()
+    model = DecisionTreeClassifier().fit(feature_extractor.fit_transform(payments), y)
+
+    payments, raw_payments = synthetic_payments(NR_PREDICTIONS, seed=1)
+    slow, fast = [], []
+    for payment, raw_payment in zip(payments, raw_payments):
+        start = perf_counter()
+        slow_prediction = model.predict(feature_extractor.transform([payment]))
+        slow.append(perf_counter() - start)
+
+        start = perf_counter()
+        fast_prediction = model.predict(feature_extractor.transform_raw(raw_payment))
+        fast.append(perf_counter() - start)
+
+        assert slow_prediction == fast_prediction
+        assert np.allclose(
+            feature_extractor.transform([payment]).toarray(),
+            feature_extractor.transform_raw(raw_payment),
+        )
+    print(f"transform + predict: {percentiles(slow)}")
+    print(f"transform_raw + predict: {percentiles(fast)}")
+
+
+if __name__ == "__main__":
+    benchmark()
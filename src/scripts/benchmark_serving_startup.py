@@ -0,0 +1,46 @@
+if __name__ == "__main__":
+    import _fix_imports
+from time import perf_counter
+
+from helpers.helpers import load_datasets
+from model_selection.budget_model import BudgetModel
+from model_selection.model_cache import ModelCache
+from model_selection.model_manifest import ModelManifest
+
+
+def benchmark():
+    """
+    Compare the time until all models are loaded when serving starts:
+    - From the datasets: build all datasets, and load the production model of each
+    budget through the model registry. This is how serving used to start
+    - From the ModelManifest: preload the models of the budgets in the manifest
+    Requires a running mlflow server with deployed models
+    """
+    budget_ids = list(ModelManifest().load().keys())
+    if not budget_ids:
+        print("The model manifest is empty, run train_models.py first")
+        return
+
+    start = perf_counter()
+    datasets = load_datasets()
+    datasets_loaded = perf_counter()
+    for dataset in datasets:
+        BudgetModel(dataset.budget.id).load(
+            BudgetModel.get_production_entry(dataset.budget.id)
+        )
+    from_datasets = perf_counter() - start
+    print(
+        f"From datasets: {from_datasets:.2f}s "
+        f"({datasets_loaded - start:.2f}s building datasets)"
+    )
+
+    start = perf_counter()
+    cache = ModelCache(max_resident_models=len(budget_ids))
+    cache.preload()
+    from_manifest = perf_counter() - start
+    print(f"From manifest: {from_manifest:.2f}s ({len(cache.models)} models)")
+    print(f"Speedup: {from_datasets / from_manifest:.1f}x")
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,85 @@
+if __name__ == "__main__":
+    import _fix_imports
+import random
+from datetime import date, timedelta
+from time import perf_counter
+from types import SimpleNamespace
+from typing import List, Tuple
+
+from model_selection.transaction_matcher import TransactionMatcher
+
+SIZES = [1000, 10000, 100000]
+# The quadratic matcher takes too long above this size
+NAIVE_MAX_SIZE = 10000
+
+
+def naive_match(b_transactions: List, y_transactions: List) -> List[Tuple]:
+    """
+    The matching as it was done before the TransactionMatcher: compare each ynab
+    transaction with each remaining bunq payment
+    """
+    b_transactions = list(b_transactions)
+    matched_transactions = []
+    for y in y_transactions:
+        for b in b_transactions:
+            if y.date == b.date and round(y.amount / 1000, 2) == float(b.amount.value):
+                b_transactions.remove(b)
+                matched_transactions.append((b, y))
+                break
+    return matched_transactions
+
+
+def synthetic_account(size: int, seed: int = 0) -> Tuple[List, List]:
+    """
+    Create size bunq payments, sorted by date. 80% of them is booked in ynab as well,
+    the ynab account also has 10% transactions that are not in bunq
+    """
+    rng = random.Random(seed)
+    start = date(2020, 1, 1)
+    b_transactions = []
+    for _ in range(size):
+        b_transactions.append(
+            SimpleNamespace(
+                date=start + timedelta(days=rng.randint(0, 3 * 365)),
+                amount=SimpleNamespace(value=f"{rng.randint(-20000, 20000) / 100:.2f}"),
+            )
+        )
+    b_transactions.sort(key=lambda t: t.date)
+    y_transactions = [
+        SimpleNamespace(date=b.date, amount=round(float(b.amount.value) * 1000))
+        for b in b_transactions
+        if rng.random() < 0.8
+    ]
+    for _ in range(size // 10):
+        y_transactions.append(
+            SimpleNamespace(
+                date=start + timedelta(days=rng.randint(0, 3 * 365)),
+                amount=rng.randint(-20000, 20000) * 10,
+            )
+        )
+    y_transactions.sort(key=lambda t: t.date)
+    return b_transactions, y_transactions
+
+
+def benchmark():
+    for size in SIZES:
+        b_transactions, y_transactions = synthetic_account(size)
+        start = perf_counter()
+        matches = TransactionMatcher().match(b_transactions, y_transactions)
+        new_time = perf_counter() - start
+        print(f"{size} transactions, {len(matches)} matches")
+        print(f"\tTransactionMatcher: {new_time:.3f}s")
+        if size > NAIVE_MAX_SIZE:
+            print(f"\tNaive: skipped")
+            continue
+        start = perf_counter()
+        naive_matches = naive_match(b_transactions, y_transactions)
+        naive_time = perf_counter() - start
+        identical = [(id(b), id(y)) for b, y in matches] == [
+            (id(b), id(y)) for b, y in naive_matches
+        ]
+        print(f"\tNaive: {naive_time:.3f}s, identical matches: {identical}")
+
+
+if __name__ == "__main__":
+    benchmark()
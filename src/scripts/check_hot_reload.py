@@ -0,0 +1,96 @@
+if __name__ == "__main__":
+    import _fix_imports
+import tempfile
+import threading
+from time import sleep
+from typing import Dict
+
+from model_selection.model_cache import ModelCache
+from model_selection.model_manifest import ModelManifest
+
+NR_BUDGETS = 5
+NR_DEPLOYMENTS = 10
+NR_CLIENTS = 8
+# Seconds a model takes to load
+LOAD_TIME = 0.2
+
+
+class SyntheticModel:
+    """
+    Stands in for a BudgetModel: loads slowly, and predicts its own version
+    """
+
+    def __init__(self, budget_id: str, version: str):
+        sleep(LOAD_TIME)
+        self.budget_id = budget_id
+        self.version = version
+
+    def warm(self):
+        pass
+
+    def predict(self, payment_data: Dict) -> str:
+        return self.version
+
+
+class SyntheticModelCache(ModelCache):
+    def __init__(self, manifest: ModelManifest):
+        super().__init__(NR_BUDGETS, manifest)
+        self.loads = []
+
+    def _load_model(self, budget_id: str, entry: Dict = None) -> SyntheticModel:
+        entry = entry or self.manifest.get(budget_id)
+        self.loads.append(budget_id)
+        return SyntheticModel(budget_id, entry["version"])
+
+
+def check():
+    """
+    Check that models are hot reloaded without failed predictions:
+    - Deploy a model for each budget, and load them all
+    - While clients predict continuously, deploy new versions of budget 0 only.
+    After each deployment, reload the changed models like serve_models.py does
+    - Check that no prediction failed, that budget 0 ends at the last version, and
+    that the other budgets were never reloaded
+    """
+    manifest = ModelManifest(f"{tempfile.mkdtemp()}/model_manifest.json")
+    for budget_id in range(NR_BUDGETS):
+        manifest.set(str(budget_id), {"version": "1"})
+    cache = SyntheticModelCache(manifest)
+    cache.preload()
+    initial_loads = len(cache.loads)
+
+    failures, predictions = [], [0]
+    stop = threading.Event()
+
+    def client(budget_id: str):
+        while not stop.is_set():
+            try:
+                cache.get_model(budget_id).predict({})
+                predictions[0] += 1
+            except Exception as e:
+                failures.append(e)
+
+    clients = [
+        threading.Thread(target=client, args=(str(i % NR_BUDGETS),))
+        for i in range(NR_CLIENTS)
+    ]
+    for thread in clients:
+        thread.start()
+    for version in range(2, NR_DEPLOYMENTS + 2):
+        manifest.set("0", {"version": str(version)})
+        cache.reload_changed()
+    stop.set()
+    for thread in clients:
+        thread.join()
+
+    reloads = cache.loads[initial_loads:]
+    print(f"{predictions[0]} predictions, {len(failures)} failed")
+    print(f"Reloaded budgets: {sorted(set(reloads))}, {len(reloads)} reloads")
+    assert not failures, failures[:5]
+    assert cache.get_model("0").version == str(NR_DEPLOYMENTS + 1)
+    assert set(reloads) == {"0"} and len(reloads) == NR_DEPLOYMENTS
+    print("OK")
+
+
+if __name__ == "__main__":
+    check()
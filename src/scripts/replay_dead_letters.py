@@ -0,0 +1,20 @@
+if __name__ == "__main__":
+    import _fix_imports
+import sys
+
+from bunq_ynab_connector.webhook_queue import WebhookQueue
+
+
+def replay_dead_letters():
+    """
+    Requeue the webhooks that failed too often. Pass payment ids as arguments to
+    replay only those, else all dead letters are replayed. The transactions server
+    picks them up on its next poll of the queue
+    """
+    payment_ids = [int(payment_id) for payment_id in sys.argv[1:]] or None
+    count = WebhookQueue().replay_dead_letters(payment_ids)
+    print(f"Replayed {count} webhooks")
+
+
+if __name__ == "__main__":
+    replay_dead_letters()
@@ -4,40 +4,48 @@ from model_selection.model_server import ModelServer
 import random
 from train_models import train_models
 from helpers.helpers import (
-    load_datasets,
     mlflow_is_initialized,
     log,
     should_restart_model_serving, RESTART_MODEL_SERVING_FILE,
 )
-from time import sleep
-import multiprocessing
+from time import sleep, perf_counter
 import os
-from multiprocessing import Process
-from typing import List
+import threading
+
+server: ModelServer = None
+# Seconds between checks of the model manifest
+MANIFEST_WATCH_INTERVAL = 2
 
-threads: List[Process] = []
 
 def serve_models():
     """
-    For each set:
-    1. Load a random port to serve it one
-    2. Create a model server
+    Serve the models of all budgets in one ModelServer:
+    1. Load a random port to serve on
+    2. Create the model server. Models that are not preloaded are loaded on their
+    first request
     3. Set the port to serve on. This also saves it to FS, to look it up for prediction
-    4. Serve async
+    4. Serve in a thread, such that we can reload models in this process
+    5. Preload the models in the ModelManifest
     """
-    global threads
-    for thread in threads:
-        thread.terminate()
-    threads = []
+    global server
     log("Serving models")
-    sets = load_datasets()
-    for set in sets:
-        port = random.randint(20000, 30000)
-        server = ModelServer(set)
-        server.port = port
-        thread = multiprocessing.Process(target=server.serve, args=())
-        thread.start()
-        threads.append(thread)
+    start = perf_counter()
+    port = random.randint(20000, 30000)
+    server = ModelServer()
+    server.port = port
+    thread = threading.Thread(target=server.serve, args=(), daemon=True)
+    thread.start()
+    server.preload()
+    log(f"Loaded {len(server.models)} models in {perf_counter() - start:.2f}s")
+
+
+def reload_models():
+    """
+    New models were deployed. Swap in the new model of each resident budget of which
+    the version changed, without restarting the server
+    """
+    reloaded = server.reload_changed()
+    log(f"Reloaded models of budgets {reloaded}")
 
 
 # If mlflow has not been initialized (eg this is the first time the models are
@@ -49,10 +57,12 @@ if __name__ == "__main__":
         print("Models trained")
     # Start serving
     serve_models()
-    # Wait indefinitely.
+    # Wait indefinitely. Each deployment updates the model manifest, watch it to
+    # reload the changed models
     while True:
-        sleep(10)
-        # If should restart, restart
+        sleep(MANIFEST_WATCH_INTERVAL)
+        server.reload_if_changed()
+        # Older trigger, reload any changed model
         if should_restart_model_serving():
             os.remove(RESTART_MODEL_SERVING_FILE)
-            serve_models()
+            reload_models()